@@ -1,14 +1,84 @@
 """
 Assembler program to convert assembly to binary
+We can run the assembler in following ways
+    python3 assembler.py asm_file.asm
+    python3 assembler.py asm_file.asm --stream --packed
+    python3 assembler.py directory_of_asm_files 'glob/**/*.asm' --jobs 8
+    python3 assembler.py directory_of_asm_files --cache
+    python3 assembler.py asm_file.asm --optimize
+    python3 assembler.py directory_of_asm_files --report json
+    python3 assembler.py asm_file.asm --source-map
+    python3 assembler.py large_asm_file.asm --pass2-jobs 4
+
+Or use it as a library, every call gets its own symbol table
+    words = assembler.assemble(source)
 By
     Naresh Joshi
 """
+import argparse
+import contextlib
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import mmap
+import os
 import re
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-import sys
 
-symbol_table = {
+import optimizer
+from cache import AssemblyCache, DEFAULT_CACHE_DIR
+from records import A_INSTRUCTION, C_INSTRUCTION, LABEL
+
+# Part of the cache key, bump it whenever a change makes the assembler produce different words
+ASSEMBLER_VERSION = '3'
+
+# Packed ROM header, magic, word count and SHA-1 of the source followed by little endian uint16 words
+ROM_MAGIC = b'HACK'
+ROM_HEADER = struct.Struct('<4sI20s')
+
+ROM_SIZE = 1 << 15
+
+# Words rendered per write when the binaries arrive as a stream
+HACK_CHUNK = 1 << 16
+
+# Records encoded by a pass2 worker per task
+PASS2_CHUNK = 1 << 16
+
+# Symbol table of a pass2 worker process, set once when the worker starts
+pass2_symbol_table = None
+
+# One pattern lexes a whole source buffer, every match skips whitespace and comments and then takes one record. The
+# source map variant keeps `//` comments as records of their own
+LEXER_PATTERN = r"""
+    (?:\s+LINE_COMMENTS|/\*.*?\*/)*
+    (?:
+        @[ \t]*(?P<address>[^\s/]+)
+      | \([ \t]*(?P<label>[^\s()]+)[ \t]*\)
+      | (?P<c>
+            (?:(?:null|[AMD]{1,3})[ \t]*=[ \t]*)?
+            [-+!&|01ADM](?:[ \t]*[-+!&|01ADM])*
+            (?:[ \t]*;[ \t]*(?:null|J[A-Z]{2}))?
+        )(?![^\s/])
+      COMMENT_RECORD
+      | (?P<error>\S+)
+      | \Z
+    )
+"""
+LEXER = re.compile(LEXER_PATTERN.replace('LINE_COMMENTS', r'|//[^\n]*').replace('COMMENT_RECORD', '').encode(),
+                   re.VERBOSE | re.DOTALL)
+COMMENT_LEXER = re.compile(LEXER_PATTERN.replace('LINE_COMMENTS', '')
+                           .replace('COMMENT_RECORD', r'| //[ \t]*(?P<comment>[^\n]*?)[ \t\r]*$').encode(),
+                           re.VERBOSE | re.DOTALL | re.MULTILINE)
+
+predefined_symbols = {
     'R0': 0, 'R1': 1, 'R2': 2, 'R3': 3,
     'R4': 4, 'R5': 5, 'R6': 6, 'R7': 7,
     'R8': 8, 'R9': 9, 'R10': 10, 'R11': 11,
@@ -61,119 +131,617 @@ jumps = {
 }
 
 
+def build_c_instructions():
+    """
+    Precompute the 16 bit word of every legal `dest=comp;jump` form, a null dest or jump may be written out or omitted
+    """
+    c_instructions = {}
+    for comp, comp_bits in computations.items():
+        for dest, dest_bits in destinations.items():
+            for jump, jump_bits in jumps.items():
+                word = int(f'111{comp_bits}{dest_bits}{jump_bits}', 2)
+                dest_forms = [f'{dest}=', ''] if dest == 'null' else [f'{dest}=']
+                jump_forms = [f';{jump}', ''] if jump == 'null' else [f';{jump}']
+                for dest_form in dest_forms:
+                    for jump_form in jump_forms:
+                        c_instructions[f'{dest_form}{comp}{jump_form}'] = word
+    return c_instructions
+
+
+c_instructions = build_c_instructions()
+
+
 def run():
-    asm_file = 'input.asm'
-    if len(sys.argv) > 1:
-        asm_file = sys.argv[1]
+    args = parse_args()
+
+    asm_files = get_files(args.asm_files, '.asm')
+    if len(asm_files) == 1 and asm_files[0] in args.asm_files and not args.cache:
+        assemble_single(asm_files[0], args.stream, args.packed, args.optimize, args.source_map, args.pass2_jobs,
+                        args.report)
+    elif not run_batch(asm_files, args.stream, args.packed, args.jobs, args.cache, args.cache_size << 20,
+                       args.optimize, args.source_map, args.pass2_jobs, args.report):
+        sys.exit(1)
+
+
+def assemble_single(asm_file, stream=False, packed=False, optimize=False, source_map=False, pass2_jobs=1,
+                    report_format='text'):
+    report = Report(asm_file)
+    if report_format == 'text':
+        print(f"Reading input asm file {asm_file}")
+        assemble_file(asm_file, stream, packed, optimize=optimize, source_map=source_map,
+                      pass2_jobs=pass2_jobs, report=report)
+        print(f"Written output file {output_file(asm_file, packed)}")
+        if source_map:
+            print(f"Written source map file {source_map_file(asm_file)}")
+        print(report.text())
+    else:
+        assemble_file(asm_file, stream, packed, optimize=optimize, source_map=source_map,
+                      pass2_jobs=pass2_jobs, report=report)
+        print(json.dumps(report.as_dict(), indent=2))
+
+
+def assemble_file(asm_file, stream=False, packed=False, cache=None, optimize=False, source_map=False, pass2_jobs=1,
+                  report=None):
+    """
+    Assemble a file to its output file without printing anything, an unchanged source is served from the cache
+    when one is given. Returns the number of words written and whether they came from the cache, the timings and
+    counters of every stage go to the report when one is given
+    """
+    report = report or Report(asm_file)
+
+    digest = source_hash(asm_file) if cache is not None or packed else None
+    if cache is not None:
+        with report.stage('cache'):
+            key = cache.key(digest)
+            # The source map is built from the parsed program, which a cached entry does not keep
+            entry = None if source_map else cache.get(key)
+        if entry is not None:
+            words, symbol_table = entry
+            with report.stage('write') as stage:
+                stage['lines'] = write_output(asm_file, words, packed, digest)
+            report.count(cached=True, rom_words=stage['lines'])
+            return stage['lines'], True
+
+    if stream:
+        # Both passes re-read the source, only the symbol table is kept in memory
+        with report.stage('pass1') as stage:
+            symbol_table = pass1(read_records(asm_file), report)
+            stage['lines'] = report.counters['labels'] + report.counters['instructions']
+        binaries = pass2(read_records(asm_file), symbol_table)
+        if cache is not None:
+            # The cache needs the words before they are written, otherwise pass2 runs lazily inside the write stage
+            with report.stage('pass2') as stage:
+                binaries = to_words(binaries)
+                stage['lines'] = len(binaries)
+    else:
+        comments = [] if source_map else None
+        with report.stage('lex') as stage:
+            program = Program(read_records(asm_file, comments))
+            stage['lines'] = program.line_numbers[-1] if len(program) else 0
+        with report.stage('pass1') as stage:
+            symbol_table = pass1(program, report)
+            stage['lines'] = len(program)
+        if optimize:
+            with report.stage('optimize') as stage:
+                program, symbol_table, saved = optimizer.optimize(program, symbol_table)
+                stage['lines'] = len(program)
+            report.count(words_saved=saved)
+        with report.stage('pass2') as stage:
+            if pass2_jobs > 1:
+                binaries = parallel_pass2(program, symbol_table, pass2_jobs)
+            else:
+                binaries = to_words(pass2(program, symbol_table))
+            stage['lines'] = len(binaries)
+        if source_map:
+            with report.stage('source map') as stage:
+                stage['lines'] = generate_source_map(source_map_file(asm_file), program, comments)
+
+    if cache is not None:
+        cache.put(key, binaries, symbol_table)
+
+    with report.stage('pass2, write' if stream and cache is None else 'write') as stage:
+        stage['lines'] = write_output(asm_file, binaries, packed, digest)
+    report.count(cached=False, rom_words=stage['lines'])
+    return stage['lines'], False
+
+
+def assemble_task(asm_file, stream, packed, cache_dir=None, cache_size=None, optimize=False, source_map=False,
+                  pass2_jobs=1):
+    """
+    Batch worker, errors are returned instead of raised so every file gets reported in order
+    """
+    start = time.perf_counter()
+    report = Report(asm_file)
+    cached = False
+    try:
+        assembly_cache = AssemblyCache(cache_dir, cache_version(optimize), cache_size) if cache_dir else None
+        words, cached = assemble_file(asm_file, stream, packed, assembly_cache, optimize, source_map, pass2_jobs,
+                                      report)
+        error = None
+    except Exception as e:
+        words = 0
+        error = f'{type(e).__name__}: {e}'
+    return asm_file, words, cached, time.perf_counter() - start, error, report.as_dict()
+
+
+def run_batch(asm_files, stream=False, packed=False, jobs=None, cache_dir=None, cache_size=64 << 20, optimize=False,
+              source_map=False, pass2_jobs=1, report_format='text'):
+    """
+    Assemble many files across a process pool, prints a summary in input order and returns False if any file failed
+    """
+    start = time.perf_counter()
+    task = functools.partial(assemble_task, stream=stream, packed=packed, cache_dir=cache_dir, cache_size=cache_size,
+                             optimize=optimize, source_map=source_map, pass2_jobs=pass2_jobs)
+    if jobs == 1:
+        results = list(map(task, asm_files))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(task, asm_files))
+
+    evicted = AssemblyCache(cache_dir, cache_version(optimize), cache_size).evict() if cache_dir else 0
+    wall_time = time.perf_counter() - start
+
+    failed = 0
+    hits = 0
+    total_words = 0
+    total_time = 0
+    reports = []
+    for asm_file, words, cached, seconds, error, report in results:
+        total_words += words
+        total_time += seconds
+        hits += cached
+        failed += error is not None
+        reports.append(dict(report, seconds=seconds, error=error))
+
+        if report_format != 'text':
+            continue
+        if error:
+            print(f'{"FAILED":>10} {"":>8}   {asm_file} : {error}')
+        else:
+            print(f'{seconds * 1000:7.1f} ms {words:8} words {asm_file}{" (cached)" if cached else ""}')
+
+    totals = {
+        'files': len(results),
+        'failed': failed,
+        'rom_words': total_words,
+        'wall_seconds': wall_time,
+        'file_seconds': total_time
+    }
+    if cache_dir:
+        totals.update(cache_hits=hits, cache_misses=len(results) - hits - failed, cache_evicted=evicted)
+
+    if report_format == 'text':
+        print(f'Assembled {len(results) - failed} of {len(results)} files, {failed} failed, {total_words} words '
+              f'in {wall_time:.3f} s wall time, {total_time:.3f} s across files')
+        if cache_dir:
+            print(f'Cache {cache_dir} : {hits} hits, {len(results) - hits - failed} misses, {evicted} evicted')
+    else:
+        print(json.dumps({'files': reports, 'totals': totals}, indent=2))
+    return failed == 0
+
+
+class Report:
+    """
+    Wall time and line count of every assembler stage of a file, along with counters of what it produced
+    """
+
+    def __init__(self, asm_file):
+        self.asm_file = asm_file
+        self.stages = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stage = {'seconds': 0, 'lines': 0}
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage['seconds'] = time.perf_counter() - start
+            self.stages[name] = stage
+
+    def count(self, **counters):
+        self.counters.update(counters)
+
+    def as_dict(self):
+        return {'file': self.asm_file, 'stages': self.stages, 'counters': self.counters}
+
+    def text(self):
+        lines = [f'Report for {self.asm_file}']
+        for name, stage in self.stages.items():
+            lines.append(f'  {name:<14} {stage["seconds"] * 1000:9.2f} ms {stage["lines"]:9} lines')
+
+        total = sum(stage['seconds'] for stage in self.stages.values())
+        lines.append(f'  {"total":<14} {total * 1000:9.2f} ms')
+
+        counters = self.counters
+        if 'labels' in counters:
+            lines.append(f'  {counters["labels"]} labels, {counters["instructions"]} instructions')
+        if 'words_saved' in counters:
+            lines.append(f'  {counters["words_saved"]} ROM words saved by the optimizer')
+        if 'rom_words' in counters:
+            cached = ' (cached)' if counters['cached'] else ''
+            lines.append(f'  {counters["rom_words"]} of {ROM_SIZE} ROM words used{cached}')
+        if counters.get('variables'):
+            lines.append(f'  {counters["variables"]} RAM variables allocated at 16 to {15 + counters["variables"]}')
+        return '\n'.join(lines)
+
+
+def cache_version(optimize=False):
+    return f'{ASSEMBLER_VERSION}-optimized' if optimize else ASSEMBLER_VERSION
+
+
+def get_files(paths, extension='.asm'):
+    """
+    Expand files, directories and glob patterns to a sorted list of files, directories and patterns only give the
+    files with the extension
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                files.update(os.path.join(dir_path, name) for name in file_names if name.endswith(extension))
+        elif glob.has_magic(path):
+            files.update(name for name in glob.glob(path, recursive=True) if name.endswith(extension))
+        else:
+            files.add(path)
+    return sorted(files)
+
+
+def output_file(asm_file, packed=False):
+    return asm_file.replace('.asm', '.rom' if packed else '.hack')
+
+
+def source_map_file(asm_file):
+    return asm_file.replace('.asm', '.map')
+
+
+def write_output(asm_file, binaries, packed=False, digest=None):
+    """
+    Write the words to the .hack file, or the packed .rom file, of the asm file and return how many were written
+    """
+    if packed:
+        return generate_rom(output_file(asm_file, packed), binaries, digest or source_hash(asm_file))
+    return generate_hack(output_file(asm_file, packed), binaries)
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Assemble HACK assembly files to .hack binary files')
+    arg_parser.add_argument('asm_files', nargs='*', default=['input.asm'],
+                            help='asm files, directories or glob patterns, more than one file is assembled in batch')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='stream the source through both passes instead of holding it in memory')
+    arg_parser.add_argument('--packed', action='store_true',
+                            help='write a packed binary .rom file instead of the textual .hack file')
+    arg_parser.add_argument('--jobs', type=int, default=None,
+                            help='worker processes for batch assembly, all cores by default')
+    arg_parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_DIR, default=None, metavar='CACHE_DIR',
+                            help=f'skip assembling unchanged sources, the cache lives in {DEFAULT_CACHE_DIR} by '
+                                 f'default')
+    arg_parser.add_argument('--cache-size', type=int, default=64, help='cache size cap in MB')
+    arg_parser.add_argument('--optimize', action='store_true',
+                            help='remove redundant instructions with the peephole optimizer before pass2')
+    arg_parser.add_argument('--source-map', action='store_true',
+                            help='also write a .map file of JSON lines from every ROM address back to its source')
+    arg_parser.add_argument('--pass2-jobs', type=int, default=1,
+                            help='worker processes that encode chunks of a large program in pass2')
+    arg_parser.add_argument('--report', choices=('text', 'json'), default='text',
+                            help='print the stage timings and counters as text or as JSON')
+
+    args = arg_parser.parse_args()
+    if args.optimize and args.stream:
+        arg_parser.error('--optimize works on the whole program and cannot be combined with --stream')
+    if args.pass2_jobs > 1 and args.stream:
+        arg_parser.error('--pass2-jobs splits the whole program in chunks and cannot be combined with --stream')
+    if args.source_map and args.stream:
+        arg_parser.error('--source-map works on the whole program and cannot be combined with --stream')
+    return args
+
+
+def assemble(source, optimize=False):
+    """
+    Assemble the text of a program to its words, the instruction tables are built once at import and shared by calls
+    """
+    program = Program(lex(source.encode()))
+    symbol_table = pass1(program)
+    if optimize:
+        program, symbol_table, saved = optimizer.optimize(program, symbol_table)
+    return to_words(pass2(program, symbol_table))
+
+
+def read_records(asm_file, comments=None):
+    """
+    Lex the asm file through a read only memory map of it
+    """
+    with open(asm_file, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from lex(buffer, comments)
+
+
+def lex(buffer, comments=None):
+    """
+    Turn the whole source buffer into (kind, operand, line number) records with a single scan of the lexer pattern,
+    the operand of a C-instruction is its dest=comp;jump text with the fields validated and whitespace removed.
+    When a comments list is given every `//` comment is appended to it as a (line number, text) pair
+    """
+    line_count = 1
+    position = 0
+    for match in (LEXER if comments is None else COMMENT_LEXER).finditer(buffer):
+        kind = match.lastgroup
+        if kind is None:
+            continue
+
+        start = match.start(kind)
+        line_count += buffer[position:start].count(b'\n')
+        position = start
+
+        if kind == 'address':
+            yield A_INSTRUCTION, match[kind].decode(), line_count
+        elif kind == 'c':
+            operand = match[kind]
+            if b' ' in operand or b'\t' in operand:
+                operand = operand.replace(b' ', b'').replace(b'\t', b'')
+            yield C_INSTRUCTION, operand.decode(), line_count
+        elif kind == 'label':
+            yield LABEL, match[kind].decode(), line_count
+        elif kind == 'comment':
+            comments.append((line_count, match[kind].decode()))
+        else:
+            raise Exception(f'Error at line {line_count}, {match[kind].decode()} is not a valid instruction')
+
+
+class Program:
+    """
+    Parsed records of a program kept in parallel arrays, the kind and line number of a record are packed integers
+    """
+
+    def __init__(self, records=()):
+        self.kinds = array('B')
+        self.operands = []
+        self.line_numbers = array('L')
+
+        for kind, operand, line_count in records:
+            self.kinds.append(kind)
+            self.operands.append(operand)
+            self.line_numbers.append(line_count)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        return zip(self.kinds, self.operands, self.line_numbers)
+
+    def instructions(self):
+        return [to_source(kind, operand) for kind, operand, line_count in self if kind != LABEL]
+
+
+def pass1(records, report=None):
+    """
+    Resolve label addresses and allocate variables in the order they are first used, in one linear pass, returns a
+    new symbol table
+    """
+    symbol_table = dict(predefined_symbols)
+    inst_count = 0
+    labels = 0
+    variables = {}
+    for kind, operand, line_count in records:
+        if kind == LABEL:
+            symbol_table[operand] = inst_count
+            labels += 1
+        else:
+            if kind == A_INSTRUCTION and not operand.isdigit() and operand not in symbol_table:
+                variables[operand] = None
+            inst_count += 1
 
-    hack_file = asm_file.replace('.asm', '.hack')
+    ram = 16
+    for symbol in variables:
+        if symbol not in symbol_table:
+            symbol_table[symbol] = ram
+            ram += 1
 
-    print(f"Reading input asm file {asm_file}")
-    lines = de_comment(asm_file)
+    if report is not None:
+        report.count(labels=labels, instructions=inst_count, variables=ram - 16)
+    return symbol_table
 
-    lines = pass1(lines)
 
-    binaries = pass2(lines)
+def pass2(records, symbol_table):
+    for kind, operand, line_count in records:
+        if kind == A_INSTRUCTION:
+            address = int(operand) if operand.isdigit() else symbol_table[operand]
+            if address > 0x7FFF:
+                raise Exception(f'Error at line {line_count}, @{operand} is not a valid address')
+            yield address
+        elif kind == C_INSTRUCTION:
+            binary = c_instructions.get(operand)
+            if binary is None:
+                raise Exception(f'Error at line {line_count}, {operand} is not a valid instruction')
+            yield binary
 
-    print(f'Assembly Instructions : {[line for line in lines if line]}')
-    print(f'Symbol Table : {symbol_table}')
-    print(f'Binary Instructions : {binaries}')
 
-    print(f"Writing to output hack file {hack_file}")
-    generate_hack(hack_file, binaries)
+def parallel_pass2(program, symbol_table, workers, chunk_size=PASS2_CHUNK):
+    """
+    Once pass1 has fixed the symbol table every instruction encodes on its own, so the program is split in chunks of
+    records that are encoded across worker processes, each with its own copy of the symbol table, and joined in order
+    """
+    chunks = [(program.kinds[start:start + chunk_size], program.operands[start:start + chunk_size],
+               program.line_numbers[start:start + chunk_size]) for start in range(0, len(program), chunk_size)]
+    if not chunks:
+        return np.empty(0, dtype=np.uint16)
 
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_pass2_worker, initargs=(symbol_table,)) as executor:
+        return np.concatenate(list(executor.map(pass2_chunk, chunks)))
 
-def de_comment(asm_file):
-    lines = []
-    with open(asm_file) as file:
-        line = file.readline()
-        is_comment = False
-        while line:
-            line = re.sub(' ', '', line).strip()
-            line = re.sub(r'//.*', '', line)
-            line = re.sub(r'/\*.*\*/', '', line)
 
-            if line.startswith('/*'):
-                is_comment = True
-                line = ''
-            elif line.endswith('*/'):
-                is_comment = False
-                line = ''
+def init_pass2_worker(symbol_table):
+    global pass2_symbol_table
+    pass2_symbol_table = symbol_table
 
-            if is_comment:
-                lines.append('')
-            else:
-                lines.append(line)
 
-            line = file.readline()
-    return lines
+def pass2_chunk(chunk):
+    kinds, operands, line_numbers = chunk
+    return to_words(pass2(zip(kinds, operands, line_numbers), pass2_symbol_table))
 
 
-def pass1(lines):
-    inst_count = 0
-    for line in lines:
-        if line:
-            if line.startswith('@'):
-                symbol = re.sub('@', '', line)
-                if not symbol.isdigit() and symbol not in symbol_table:
-                    symbol_table[symbol] = -1
-                inst_count += 1
-            elif line.startswith('('):
-                symbol = re.sub(r'[()]', '', line)
-                symbol_table[symbol] = inst_count
-                new_line = re.sub(r'.*\)', '', line)
-                if new_line:
-                    lines[lines.index(line)] = new_line
-                else:
-                    lines[lines.index(line)] = ''
-            else:
-                inst_count += 1
+def to_source(kind, operand):
+    if kind == A_INSTRUCTION:
+        return f'@{operand}'
+    elif kind == LABEL:
+        return f'({operand})'
+    return operand
 
-    ram = 16
-    for symbol in symbol_table.keys():
-        if symbol_table[symbol] == -1:
-            symbol_table[symbol] = ram
-            ram += 1
-    return lines
 
+def to_binary(binary):
+    return f'{binary:016b}'
 
-def pass2(lines):
-    binaries = []
 
-    line_count = 0
-    for line in lines:
-        line_count += 1
-        if line:
-            if line.startswith('@'):
-                inst = re.sub('@', '', line)
-                inst = inst if inst.isdigit() else symbol_table[inst]
-                binaries.append('0' + np.binary_repr(int(inst), 15))
-            else:
-                inst = line
-                if '=' not in inst:
-                    inst = f'null={inst}'
-                if ';' not in inst:
-                    inst = f'{inst};null'
+def to_words(binaries):
+    """
+    Collect the binaries in one uint16 array, buffers of words are used without a copy
+    """
+    if isinstance(binaries, np.ndarray):
+        return binaries.astype(np.uint16, copy=False)
+    if isinstance(binaries, (array, memoryview)):
+        return np.frombuffer(binaries, dtype=np.uint16)
+    return np.fromiter(binaries, dtype=np.uint16)
 
-                tokens = re.split(r'[=;]', inst)
-                if len(tokens) < 3 or len(tokens) > 3:
-                    raise Exception(f'Error at line {line_count}, {line} is not a valid instruction')
 
-                dest = destinations.get(tokens[0], None)
-                comp = computations.get(tokens[1], None)
-                jump = jumps.get(tokens[2], None)
+def word_chunks(binaries):
+    """
+    Arrays come out whole, iterators in chunks of HACK_CHUNK words so that streaming keeps its memory flat
+    """
+    if isinstance(binaries, (np.ndarray, array, memoryview, list)):
+        yield to_words(binaries)
+        return
 
-                if not dest or not comp or not jump:
-                    raise Exception(f'Error at line {line_count}, {line} is not a valid instruction')
+    binaries = iter(binaries)
+    while True:
+        words = np.fromiter(itertools.islice(binaries, HACK_CHUNK), dtype=np.uint16)
+        if not len(words):
+            return
+        yield words
 
-                binaries.append(f'111{comp}{dest}{jump}')
-    return binaries
 
+def render_hack(words):
+    """
+    Render every word as a line of 16 ASCII bits in one vectorized pass, big endian bytes unpack MSB first
+    """
+    bits = np.unpackbits(words.astype('>u2').view(np.uint8)).reshape(-1, 16)
 
-def generate_hack(hack_file, binaries):
-    with open(hack_file, 'w') as file:
-        for binary in binaries:
-            file.write(binary + '\n')
+    text = np.empty((len(words), 17), dtype=np.uint8)
+    np.add(bits, ord('0'), out=text[:, :16])
+    text[:, 16] = ord('\n')
+    return text
 
 
-run()
+def generate_hack(hack_file, binaries):
+    count = 0
+    with open(hack_file, 'wb') as file:
+        for words in word_chunks(binaries):
+            file.write(render_hack(words))
+            count += len(words)
+    return count
+
+
+def generate_source_map(map_file, program, comments=()):
+    """
+    Write the source map of the program, returns the number of addresses written
+    """
+    address = 0
+    with open(map_file, 'w') as file:
+        for address, line in enumerate(source_map_lines(program, comments), 1):
+            file.write(line)
+    return address
+
+
+def source_map_lines(program, comments=()):
+    """
+    Yield one JSON line per ROM address with its source line and instruction, the label it falls under, the VM
+    function that label belongs to and the `// vm command` comment of the region it came from. Comments are matched by
+    line number, so the map stays right after the optimizer has removed instructions
+    """
+    quote = functools.lru_cache(maxsize=None)(json.dumps)
+    comments = iter(comments)
+    next_comment = next(comments, None)
+
+    address = 0
+    label = function = comment = 'null'
+    for kind, operand, line_count in program:
+        if kind == LABEL:
+            label = quote(operand)
+            if '.' in operand and '$' not in operand:
+                # Function labels are written as Class.name, labels inside functions by the standard translator as
+                # Class.name$label and by this repo's translator without a dot
+                function = label
+            continue
+
+        while next_comment is not None and next_comment[0] <= line_count:
+            comment = quote(next_comment[1])
+            next_comment = next(comments, None)
+
+        yield (f'{{"address":{address},"line":{line_count},"source":{quote(to_source(kind, operand))},'
+               f'"label":{label},"function":{function},"vm":{comment}}}\n')
+        address += 1
+
+
+def read_source_map(map_file):
+    """
+    Read the entries of a source map file, one dict per ROM address
+    """
+    with open(map_file) as file:
+        return [json.loads(line) for line in file]
+
+
+def build_source_map(asm_file):
+    """
+    The source map entries of an asm file, without writing the map or the binaries
+    """
+    comments = []
+    program = Program(read_records(asm_file, comments))
+    return [json.loads(line) for line in source_map_lines(program, comments)]
+
+
+def source_hash(asm_file):
+    digest = hashlib.sha1()
+    with open(asm_file, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def generate_rom(rom_file, binaries, digest):
+    words = to_words(binaries).astype('<u2', copy=False)
+
+    with open(rom_file, 'wb') as file:
+        file.write(ROM_HEADER.pack(ROM_MAGIC, len(words), digest))
+        file.write(words)
+    return len(words)
+
+
+def load_rom(rom_file):
+    """
+    Memory map a packed ROM file, returns the words as a uint16 view on the mapping and the source hash
+    """
+    with open(rom_file, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < ROM_HEADER.size:
+            raise Exception(f'Error in - {rom_file} is shorter than the packed rom header')
+        rom = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, word_count, digest = ROM_HEADER.unpack_from(rom)
+    if magic != ROM_MAGIC:
+        raise Exception(f'Error in - {rom_file} is not a packed rom file')
+    if len(rom) < ROM_HEADER.size + 2 * word_count:
+        raise Exception(f'Error in - {rom_file} is truncated, its header has {word_count} words but the file holds '
+                        f'{(len(rom) - ROM_HEADER.size) // 2}')
+
+    words = memoryview(rom)[ROM_HEADER.size:ROM_HEADER.size + 2 * word_count].cast('H')
+    if sys.byteorder == 'big':
+        # The view can only be used as is on little endian machines, elsewhere the words are copied and swapped
+        words = array('H', words)
+        words.byteswap()
+    return words, digest
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,337 @@
+"""
+Benchmarks for the assembler, every benchmark reports its throughput per second.
+We can run the benchmarks in following ways
+    python3 benchmark.py
+    python3 benchmark.py asm_file.asm
+    python3 benchmark.py asm_file.asm --repeat 40
+    python3 benchmark.py --only labels --labels 10000 100000 1000000
+    python3 benchmark.py --only parallel --workers 1 2 4 8
+
+By
+    Naresh Joshi
+"""
+import argparse
+import collections
+import filecmp
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+import assembler
+
+DEFAULT_ASM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '06', 'pong', 'Pong.asm')
+
+
+def run():
+    args = parse_args()
+
+    for name in args.only or BENCHMARKS:
+        BENCHMARKS[name](args)
+        print()
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Assembler benchmarks')
+    arg_parser.add_argument('asm_file', nargs='?', default=DEFAULT_ASM_FILE)
+    arg_parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='benchmarks to run, all by default')
+    arg_parser.add_argument('--repeat', type=int, default=40, help='times the program is repeated')
+    arg_parser.add_argument('--labels', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help='label counts of the synthetic programs')
+    arg_parser.add_argument('--legacy-limit', type=int, default=20_000,
+                            help='largest label count the quadratic legacy pass1 is run on')
+    arg_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                            help='worker counts of the chunked parallel pass2')
+    return arg_parser.parse_args()
+
+
+def benchmark_pass2(args):
+    with open(args.asm_file) as file:
+        lines = list(legacy_de_comment(file))
+
+    legacy_lines = legacy_pass1(lines, dict(assembler.predefined_symbols)) * args.repeat
+
+    program = assembler.Program(assembler.read_records(args.asm_file))
+    symbol_table = assembler.pass1(program)
+    program = assembler.Program(list(program) * args.repeat)
+
+    instructions = len(program.instructions())
+    print(f'pass2 : {args.asm_file} repeated {args.repeat} times, {instructions} instructions')
+
+    legacy_binaries, legacy_seconds = measure(legacy_pass2, legacy_lines, symbol_table)
+    binaries, seconds = measure(lambda: list(assembler.pass2(program, symbol_table)))
+
+    if legacy_binaries != [assembler.to_binary(binary) for binary in binaries]:
+        raise Exception('Error in - pass2 output does not match the legacy string encoder')
+
+    report('pass2 strings (legacy)', instructions, legacy_seconds)
+    report('pass2 integers', instructions, seconds)
+    print(f'Speedup : {legacy_seconds / seconds:.2f}x')
+
+
+def benchmark_parallel(args):
+    program = assembler.Program(assembler.read_records(args.asm_file))
+    symbol_table = assembler.pass1(program)
+    program = assembler.Program(list(program) * args.repeat)
+
+    instructions = len(program.instructions())
+    print(f'parallel pass2 : {args.asm_file} repeated {args.repeat} times, {instructions} instructions, '
+          f'{os.cpu_count()} cores')
+
+    words, seconds = measure(lambda: assembler.to_words(assembler.pass2(program, symbol_table)))
+    report('pass2', instructions, seconds)
+    for workers in args.workers:
+        parallel_words, parallel_seconds = measure(assembler.parallel_pass2, program, symbol_table, workers)
+        if not np.array_equal(words, parallel_words):
+            raise Exception(f'Error in - parallel pass2 with {workers} workers does not match pass2')
+        report(f'{workers} workers', instructions, parallel_seconds)
+        print(f'Speedup : {seconds / parallel_seconds:.2f}x')
+
+
+def benchmark_render(args):
+    program = assembler.Program(assembler.read_records(args.asm_file))
+    words = assembler.to_words(assembler.pass2(program, assembler.pass1(program)))
+    words = np.tile(words, args.repeat)
+    print(f'render : {args.asm_file} repeated {args.repeat} times, {len(words)} words')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        legacy_file = os.path.join(temp_dir, 'legacy.hack')
+        hack_file = os.path.join(temp_dir, 'vectorized.hack')
+
+        _, legacy_seconds = measure(legacy_generate_hack, legacy_file, words.tolist())
+        _, seconds = measure(assembler.generate_hack, hack_file, words)
+
+        if not filecmp.cmp(legacy_file, hack_file, shallow=False):
+            raise Exception('Error in - vectorized .hack text does not match the per word formatting')
+
+    report('format per word (legacy)', len(words), legacy_seconds, 'words')
+    report('vectorized render', len(words), seconds, 'words')
+    print(f'Speedup : {legacy_seconds / seconds:.2f}x')
+
+
+def benchmark_labels(args):
+    print('pass1 : synthetic programs, every label is followed by a jump to it')
+    for label_count in args.labels:
+        lines = synthetic_labels(label_count)
+
+        if label_count <= args.legacy_limit:
+            legacy_lines, legacy_seconds = measure(legacy_pass1, list(lines), dict(assembler.predefined_symbols))
+            report(f'{label_count:>9,} labels (legacy)', label_count, legacy_seconds, 'labels')
+
+        source = '\n'.join(lines).encode()
+        program, seconds = measure(lambda: assembler.Program(assembler.lex(source)))
+        _, pass1_seconds = measure(assembler.pass1, program)
+        report(f'{label_count:>9,} labels', label_count, seconds + pass1_seconds, 'labels')
+
+
+def benchmark_lexer(args):
+    with open(args.asm_file) as file:
+        source = file.read()
+    line_count = source.count('\n')
+
+    legacy_calls = count_regex_calls(legacy_assemble, source.splitlines())
+    calls = count_regex_calls(assembler.assemble, source)
+    print(f'lexer : regex calls per line over {args.asm_file}, {line_count} lines')
+    print(f'{"legacy de_comment, pass1, pass2":<30} {sum(legacy_calls.values()) / line_count:8.3f} calls/line '
+          f'{dict(legacy_calls)}')
+    print(f'{"lexer":<30} {calls["finditer"] / line_count:8.5f} calls/line {calls["finditer"]} finditer over the '
+          f'buffer, {calls["matches"] / line_count:.3f} matches/line')
+
+    source = source * args.repeat
+    lines = source.splitlines()
+    buffer = source.encode()
+    print(f'lexer : {args.asm_file} repeated {args.repeat} times, {len(lines)} lines')
+
+    _, legacy_seconds = measure(lambda: assembler.Program(legacy_parse(legacy_de_comment(lines))))
+    _, seconds = measure(lambda: assembler.Program(assembler.lex(buffer)))
+    report('de_comment, parse (legacy)', len(lines), legacy_seconds, 'lines')
+    report('lex', len(lines), seconds, 'lines')
+    print(f'Speedup : {legacy_seconds / seconds:.2f}x')
+
+
+def count_regex_calls(function, *args):
+    """
+    Run the function with every re module function and the lexer pattern counting their calls
+    """
+    calls = collections.Counter()
+    originals = {name: getattr(re, name) for name in ('sub', 'split', 'match', 'search', 'findall', 'finditer')}
+
+    def counting(name):
+        def call(*call_args, **call_kwargs):
+            calls[name] += 1
+            return originals[name](*call_args, **call_kwargs)
+
+        return call
+
+    class CountingPattern:
+        def __init__(self, pattern):
+            self.pattern = pattern
+
+        def finditer(self, buffer):
+            calls['finditer'] += 1
+            for match in self.pattern.finditer(buffer):
+                calls['matches'] += 1
+                yield match
+
+    lexer = assembler.LEXER
+    for name in originals:
+        setattr(re, name, counting(name))
+    assembler.LEXER = CountingPattern(lexer)
+    try:
+        function(*args)
+    finally:
+        for name, original in originals.items():
+            setattr(re, name, original)
+        assembler.LEXER = lexer
+    return calls
+
+
+def synthetic_labels(label_count):
+    lines = []
+    for label in range(label_count):
+        lines += [f'(L{label})', f'@L{label}', 'D;JGT']
+    return lines
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def report(name, count, seconds, unit='instructions'):
+    print(f'{name:<30} {seconds:8.3f} s {count / seconds:14,.0f} {unit}/s')
+
+
+def legacy_generate_hack(hack_file, binaries):
+    with open(hack_file, 'w') as file:
+        for binary in binaries:
+            file.write(f'{binary:016b}' + '\n')
+
+
+def legacy_assemble(lines):
+    symbol_table = dict(assembler.predefined_symbols)
+    return legacy_pass2(legacy_pass1(list(legacy_de_comment(lines)), symbol_table), symbol_table)
+
+
+def legacy_de_comment(lines):
+    """
+    The line by line comment stripping the assembler used before the lexer, three regex calls per line
+    """
+    is_comment = False
+    for line in lines:
+        line = re.sub(' ', '', line).strip()
+        line = re.sub(r'//.*', '', line)
+        line = re.sub(r'/\*.*\*/', '', line)
+
+        if line.startswith('/*'):
+            is_comment = True
+            line = ''
+        elif line.endswith('*/'):
+            is_comment = False
+            line = ''
+
+        if is_comment:
+            yield ''
+        else:
+            yield line
+
+
+def legacy_parse(lines):
+    """
+    The record parsing that followed de_comment before the lexer
+    """
+    line_count = 0
+    for line in lines:
+        line_count += 1
+        while line.startswith('('):
+            end = line.find(')')
+            yield assembler.LABEL, line[1:end], line_count
+            line = line[end + 1:]
+
+        if line:
+            if line[0] == '@':
+                yield assembler.A_INSTRUCTION, line[1:], line_count
+            else:
+                yield assembler.C_INSTRUCTION, line, line_count
+
+
+def legacy_pass1(lines, symbol_table):
+    """
+    The pass1 the assembler used before parsed records, it rewrites every label line with a linear `lines.index` scan
+    """
+    inst_count = 0
+    for line in lines:
+        if line:
+            if line.startswith('@'):
+                symbol = re.sub('@', '', line)
+                if not symbol.isdigit() and symbol not in symbol_table:
+                    symbol_table[symbol] = -1
+                inst_count += 1
+            elif line.startswith('('):
+                symbol = re.sub(r'[()]', '', line)
+                symbol_table[symbol] = inst_count
+                new_line = re.sub(r'.*\)', '', line)
+                if new_line:
+                    lines[lines.index(line)] = new_line
+                else:
+                    lines[lines.index(line)] = ''
+            else:
+                inst_count += 1
+
+    ram = 16
+    for symbol in symbol_table.keys():
+        if symbol_table[symbol] == -1:
+            symbol_table[symbol] = ram
+            ram += 1
+    return lines
+
+
+def legacy_pass2(lines, symbol_table):
+    """
+    The string building pass2 the assembler used before the integer encoder, kept as the benchmark baseline
+    """
+    binaries = []
+
+    line_count = 0
+    for line in lines:
+        line_count += 1
+        if line:
+            if line.startswith('@'):
+                inst = re.sub('@', '', line)
+                inst = inst if inst.isdigit() else symbol_table[inst]
+                binaries.append('0' + np.binary_repr(int(inst), 15))
+            else:
+                inst = line
+                if '=' not in inst:
+                    inst = f'null={inst}'
+                if ';' not in inst:
+                    inst = f'{inst};null'
+
+                tokens = re.split(r'[=;]', inst)
+                if len(tokens) < 3 or len(tokens) > 3:
+                    raise Exception(f'Error at line {line_count}, {line} is not a valid instruction')
+
+                dest = assembler.destinations.get(tokens[0], None)
+                comp = assembler.computations.get(tokens[1], None)
+                jump = assembler.jumps.get(tokens[2], None)
+
+                if not dest or not comp or not jump:
+                    raise Exception(f'Error at line {line_count}, {line} is not a valid instruction')
+
+                binaries.append(f'111{comp}{dest}{jump}')
+    return binaries
+
+
+BENCHMARKS = {
+    'pass2': benchmark_pass2,
+    'labels': benchmark_labels,
+    'lexer': benchmark_lexer,
+    'parallel': benchmark_parallel,
+    'render': benchmark_render
+}
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,98 @@
+"""
+On disk cache of assembled programs, an entry holds the words and the symbol table of a program and is keyed by the
+hash of its source text and the assembler version. The cache is capped in size and evicts the least recently used
+entries first, a hit refreshes the modification time of its entry.
+By
+    Naresh Joshi
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'nand2tetris', 'assembler')
+
+# Entry header, length of the json symbol table and number of words, followed by both
+ENTRY_HEADER = struct.Struct('<II')
+ENTRY_SUFFIX = '.entry'
+
+
+class AssemblyCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, version='', max_bytes=64 << 20):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_bytes = max_bytes
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, source_digest):
+        return hashlib.sha256(self.version.encode() + source_digest).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the words and symbol table stored for the key, or None on a miss. A truncated or corrupt entry is a
+        miss, the program is assembled again and its entry replaced
+        """
+        entry_file = os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+        try:
+            with open(entry_file, 'rb') as file:
+                data = file.read()
+            os.utime(entry_file)
+        except OSError:
+            return None
+
+        try:
+            symbols_size, word_count = ENTRY_HEADER.unpack_from(data)
+            symbols_end = ENTRY_HEADER.size + symbols_size
+            if len(data) != symbols_end + 2 * word_count:
+                return None
+            symbol_table = json.loads(data[ENTRY_HEADER.size:symbols_end])
+        except (struct.error, ValueError):
+            return None
+
+        words = array('H')
+        words.frombytes(data[symbols_end:symbols_end + 2 * word_count])
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words, symbol_table
+
+    def put(self, key, words, symbol_table):
+        symbols = json.dumps(symbol_table, separators=(',', ':')).encode()
+        words = array('H', words)
+        if sys.byteorder == 'big':
+            words.byteswap()
+
+        # Written to a temporary file and renamed so that concurrent readers never see a partial entry
+        fd, temp_file = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(ENTRY_HEADER.pack(len(symbols), len(words)))
+            file.write(symbols)
+            file.write(words)
+        os.replace(temp_file, os.path.join(self.cache_dir, key + ENTRY_SUFFIX))
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in its size cap, returns the number removed
+        """
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            removed += 1
+        return removed
@@ -0,0 +1,231 @@
+"""
+Peephole optimizer for HACK assembly, it runs between pass1 and pass2 and removes instructions whose effects are
+never observed. Every basic block, split at labels and after jumps, is optimized on its own
+    - reloading A with the value it already holds
+    - writes to A or D that are overwritten before they are read
+    - stores to M that are overwritten at the same address before they are read
+    - an increment of M followed by a decrement into A, as in a push followed by a pop, fused to a plain load of A
+Labels are kept, so every jump target stays in place, and the label addresses are resolved again afterwards. A
+program that jumps to a numeric address or computes with a label address is left as it is.
+By
+    Naresh Joshi
+"""
+from collections import namedtuple
+
+from records import A_INSTRUCTION, C_INSTRUCTION, LABEL
+
+# Registers read and written by an instruction, M as a write is a store to RAM[A]
+Effects = namedtuple('Effects', ('reads', 'writes', 'jumps'))
+
+A_LOAD = Effects(frozenset(), frozenset('A'), False)
+
+# Passes are repeated while they still find something, one removal can expose another
+MAX_ROUNDS = 8
+
+
+def optimize(program, symbol_table):
+    """
+    Returns the optimized program, its symbol table with the label addresses resolved again and the ROM words saved
+    """
+    labels = {operand for kind, operand, line_count in program if kind == LABEL}
+    records = list(program)
+
+    if not is_relocatable(records, labels):
+        # A numeric jump target or an address computed from a label would be wrong once instructions move, so leave
+        # the program alone
+        return program, symbol_table, 0
+
+    for _ in range(MAX_ROUNDS):
+        removed = set()
+        fused = {}
+        for block in basic_blocks(records):
+            block_fused, block_removed = fused_increments(records, block)
+            if block_fused:
+                # The other passes look at this block again in the next round, once the fused records are in place
+                fused.update(block_fused)
+                removed |= block_removed
+                continue
+
+            removed |= redundant_a_loads(records, block, symbol_table, labels)
+            removed |= dead_stores(records, block, removed)
+            removed |= dead_register_writes(records, block, removed)
+        if not removed:
+            break
+        records = [fused.get(index, record) for index, record in enumerate(records) if index not in removed]
+
+    # The optimized program is of the type of the one given, the assembler's Program
+    optimized = type(program)(records)
+    saved = instruction_count(program) - instruction_count(optimized)
+    return optimized, relocate(optimized, symbol_table), saved
+
+
+def instruction_count(program):
+    return sum(1 for kind, operand, line_count in program if kind != LABEL)
+
+
+def relocate(program, symbol_table):
+    """
+    Resolve the labels of the optimized program again, variables keep the RAM addresses pass1 gave them
+    """
+    symbol_table = dict(symbol_table)
+    inst_count = 0
+    for kind, operand, line_count in program:
+        if kind == LABEL:
+            symbol_table[operand] = inst_count
+        else:
+            inst_count += 1
+    return symbol_table
+
+
+def effects(kind, operand):
+    if kind == A_INSTRUCTION:
+        return A_LOAD
+
+    dest, _, rest = operand.rpartition('=')
+    comp, _, jump = rest.partition(';')
+    dest = '' if dest == 'null' else dest
+    jumps = jump not in ('', 'null')
+
+    reads = set()
+    if 'D' in comp:
+        reads.add('D')
+    if 'M' in comp:
+        reads.add('M')
+    if 'A' in comp or 'M' in comp or 'M' in dest or jumps:
+        reads.add('A')
+    return Effects(frozenset(reads), frozenset(dest), jumps)
+
+
+def basic_blocks(records):
+    """
+    Yield the record indexes of every basic block, a block starts at a label and ends after a jump
+    """
+    block = []
+    for index, (kind, operand, line_count) in enumerate(records):
+        if kind == LABEL:
+            if block:
+                yield block
+            block = []
+        else:
+            block.append(index)
+            if kind == C_INSTRUCTION and effects(kind, operand).jumps:
+                yield block
+                block = []
+    if block:
+        yield block
+
+
+def is_relocatable(records, labels):
+    """
+    Whether the program still runs the same once instructions move and its labels are resolved again. Every constant
+    jump target has to be a label, a jump to a numeric address would land elsewhere. A label address may be copied
+    between registers and RAM, as a call stores its return address for the jump of its return, but nothing may be
+    computed from it, as a jump table adding an offset to it, or be read or stored at it as a RAM address
+    """
+    for block in basic_blocks(records):
+        target = None
+        # Registers holding a label address
+        holding = set()
+        for index in block:
+            kind, operand, line_count = records[index]
+            instruction = effects(kind, operand)
+            if kind == A_INSTRUCTION:
+                target = operand
+                holding.discard('A')
+                if operand in labels:
+                    holding.add('A')
+            else:
+                comp = operand.rpartition('=')[2].partition(';')[0]
+                if 'A' in holding and 'M' in instruction.reads | instruction.writes:
+                    return False
+                if comp not in holding and any(register in comp for register in holding):
+                    return False
+                registers = instruction.writes - {'M'}
+                holding = holding | registers if comp in holding else holding - registers
+                if 'A' in registers:
+                    target = None
+            if instruction.jumps and target is not None and target not in labels:
+                return False
+    return True
+
+
+def a_value(operand, symbol_table, labels):
+    """
+    What A holds after loading the operand, labels compare by name as their addresses move while optimizing
+    """
+    if operand in labels:
+        return 'label', operand
+    return 'value', int(operand) if operand.isdigit() else symbol_table[operand]
+
+
+def redundant_a_loads(records, block, symbol_table, labels):
+    removed = set()
+    value = None
+    for index in block:
+        kind, operand, line_count = records[index]
+        if kind == A_INSTRUCTION:
+            loaded = a_value(operand, symbol_table, labels)
+            if loaded == value:
+                removed.add(index)
+            value = loaded
+        elif 'A' in effects(kind, operand).writes:
+            value = None
+    return removed
+
+
+def fused_increments(records, block):
+    """
+    `M=M+1` directly followed by `AM=M-1` leaves M as it was and loads it into A, so the pair becomes `A=M`
+    """
+    fused = {}
+    removed = set()
+    for index, next_index in zip(block, block[1:]):
+        if index in fused or index in removed:
+            continue
+        kind, operand, line_count = records[index]
+        next_kind, next_operand, next_line_count = records[next_index]
+        if kind == next_kind == C_INSTRUCTION and operand == 'M=M+1' and next_operand == 'AM=M-1':
+            fused[next_index] = next_kind, 'A=M', next_line_count
+            removed.add(index)
+    return fused, removed
+
+
+def dead_stores(records, block, removed):
+    """
+    A store is dead when the next access to M at the same address, before A changes, is another store
+    """
+    dead = set()
+    store = None
+    for index in block:
+        if index in removed:
+            continue
+        kind, operand, line_count = records[index]
+        instruction = effects(kind, operand)
+        if 'M' in instruction.reads:
+            store = None
+        if 'M' in instruction.writes:
+            if store is not None:
+                dead.add(store)
+            store = index if instruction.writes == {'M'} and not instruction.jumps else None
+        if 'A' in instruction.writes:
+            store = None
+    return dead
+
+
+def dead_register_writes(records, block, removed):
+    """
+    Backward liveness of A and D over the block, everything is live at its end
+    """
+    dead = set()
+    live = {'A', 'D'}
+    for index in reversed(block):
+        if index in removed:
+            continue
+        kind, operand, line_count = records[index]
+        instruction = effects(kind, operand)
+        registers = instruction.writes - {'M'}
+        if registers and registers == instruction.writes and not instruction.jumps and not registers & live:
+            dead.add(index)
+            continue
+        live = (live - registers) | (instruction.reads - {'M'})
+    return dead
@@ -0,0 +1,9 @@
+"""
+Kinds of the records the assembler parses a program into, a record is a (kind, operand, line number) tuple. They live
+on their own so that the optimizer can use them without importing the assembler.
+By
+    Naresh Joshi
+"""
+A_INSTRUCTION = 0
+C_INSTRUCTION = 1
+LABEL = 2
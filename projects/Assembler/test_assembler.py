@@ -0,0 +1,85 @@
+"""
+Tests of the assembler, the lexer records of the layouts the baseline assembler accepted and the programs the
+optimizer may and may not relocate, optimized programs are run on the emulator.
+We can run the tests in following ways
+    python3 -m pytest test_assembler.py
+By
+    Naresh Joshi
+"""
+import os
+import sys
+
+import pytest
+
+import assembler
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.append(os.path.join(PROJECTS, 'Emulator'))
+
+import cpu
+
+
+def test_inline_label_and_instruction():
+    # A label and the instruction after it may share a line
+    records = list(assembler.lex(b'(LOOP)@5\n@LOOP\n0;JMP'))
+    assert records == [(assembler.LABEL, 'LOOP', 1), (assembler.A_INSTRUCTION, '5', 1),
+                       (assembler.A_INSTRUCTION, 'LOOP', 2), (assembler.C_INSTRUCTION, '0;JMP', 3)]
+
+
+def test_label_with_inner_whitespace():
+    # Spaces and tabs around the name inside the parentheses are not part of it
+    records = list(assembler.lex(b'( LOOP )\n(\tEND\t)\n@LOOP\n0;JMP'))
+    assert records == [(assembler.LABEL, 'LOOP', 1), (assembler.LABEL, 'END', 2),
+                       (assembler.A_INSTRUCTION, 'LOOP', 3), (assembler.C_INSTRUCTION, '0;JMP', 4)]
+    assert list(assembler.assemble('( LOOP )\n@LOOP\n0;JMP')) == list(assembler.assemble('(LOOP)\n@LOOP\n0;JMP'))
+
+
+def test_invalid_instruction():
+    with pytest.raises(Exception, match='Error at line 2'):
+        list(assembler.lex(b'@1\nD=X\n'))
+
+
+def test_truncated_rom(tmp_path):
+    rom_file = str(tmp_path / 'Add.rom')
+    assembler.generate_rom(rom_file, assembler.assemble('@2\nD=A\n@3\nD=D+A\n@0\nM=D'), bytes(20))
+    words, digest = assembler.load_rom(rom_file)
+    assert len(words) == 6
+    del words
+
+    with open(rom_file, 'rb') as file:
+        data = file.read()
+    for size, message in ((len(data) - 4, 'is truncated'), (10, 'is shorter than'), (0, 'is shorter than')):
+        with open(rom_file, 'wb') as file:
+            file.write(data[:size])
+        with pytest.raises(Exception, match=message):
+            assembler.load_rom(rom_file)
+
+
+def test_optimizer_keeps_label_jumps():
+    # Every label is loaded right before its jump, so the duplicate load of D can go
+    source = '@5\nD=A\n@5\nD=A\n(L)\n@L\nD;JGT\n@L\n0;JMP'
+    assert len(assembler.assemble(source, optimize=True)) < len(assembler.assemble(source))
+
+
+def test_optimizer_relocates_calls():
+    # Every call stores its label return address and every return jumps to it, both follow the moved labels
+    asm_file = os.path.join(PROJECTS, 'Translator', '08', 'FunctionCalls', 'FibonacciElement', 'FibonacciElement.asm')
+    with open(asm_file) as file:
+        source = file.read()
+    words = assembler.assemble(source)
+    optimized = assembler.assemble(source, optimize=True)
+    assert len(optimized) < len(words)
+
+    results = []
+    for program in (words, optimized):
+        machine = cpu.CPU(program)
+        assert machine.run(6000)[0] == cpu.HALTED
+        results.append((machine.ram[0], machine.ram[261]))
+    assert results == [(262, 3), (262, 3)]
+
+
+def test_optimizer_refuses_label_arithmetic():
+    # A jump table adds an offset to a label address, the sum does not follow the label when instructions move
+    source = '@5\nD=A\n@5\nD=A\n@TABLE\nD=D+A\n@R0\nM=D\n(TABLE)\n@R0\nA=M\n0;JMP'
+    assert list(assembler.assemble(source, optimize=True)) == list(assembler.assemble(source))
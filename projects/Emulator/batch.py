@@ -0,0 +1,95 @@
+"""
+Lock step emulation of many HACK machines running the same ROM, as for test vectors or fuzzing with different initial
+RAM. A, D, PC and RAM hold one row per machine and every instruction executes as one NumPy operation across all the
+machines at its address. Machines whose program counters diverge are grouped by address on every step.
+By
+    Naresh Joshi
+"""
+import numpy as np
+
+import cpu
+
+
+class BatchCPU:
+    """
+    Many HACK computers over one decoded ROM, ram is a (machines, 32K) int16 array that can be filled before a run
+    """
+
+    def __init__(self, words, machines):
+        self.rom = cpu.decode_rom(words)
+        self.machines = machines
+        self.ram = np.zeros((machines, cpu.RAM_SIZE), dtype=np.int16)
+        self.a = np.zeros(machines, dtype=np.int32)
+        self.d = np.zeros(machines, dtype=np.int32)
+        self.pc = np.zeros(machines, dtype=np.int32)
+        self.cycles = np.zeros(machines, dtype=np.int64)
+
+    def ended(self):
+        """
+        Mask of the machines whose program counter has left the ROM
+        """
+        return self.pc >= len(self.rom)
+
+    def run(self, max_cycles):
+        """
+        Step every machine still in the ROM for up to max_cycles cycles, returns the number of lock steps executed
+        """
+        rows = np.arange(self.machines)
+        for step in range(max_cycles):
+            running = rows[self.pc < len(self.rom)]
+            if not len(running):
+                return step
+
+            pcs = self.pc[running]
+            first = pcs[0]
+            if (pcs == first).all():
+                # Every running machine is at the same address, the common case until branches diverge
+                self.execute(first, running if len(running) < self.machines else slice(None), running)
+            else:
+                order = np.argsort(pcs, kind='stable')
+                pcs = pcs[order]
+                starts = np.flatnonzero(np.diff(pcs)) + 1
+                for group in np.split(running[order], starts):
+                    self.execute(self.pc[group[0]], group, group)
+        return max_cycles
+
+    def execute(self, address, machines, rows):
+        """
+        Execute the instruction at address on the machines, a slice of all of them or an index array, rows are
+        their indexes for RAM access
+        """
+        is_address, value, comp, reads_m, dest, jump = self.rom[address]
+        self.cycles[machines] += 1
+        if is_address:
+            self.a[machines] = value
+            self.pc[machines] = address + 1
+            return
+
+        a = self.a[machines]
+        # Negative A values address RAM from the top like the interpreter's array indexing
+        ram_address = a & 0x7FFF
+        m = self.ram[rows, ram_address].astype(np.int32) if reads_m else 0
+        out = comp(a, self.d[machines], m)
+        if np.isscalar(out):
+            out = np.full(len(a), out, dtype=np.int32)
+
+        if dest & cpu.DEST_M:
+            self.ram[rows, ram_address] = out
+        if dest & cpu.DEST_D:
+            self.d[machines] = out
+
+        if jump is None:
+            self.pc[machines] = address + 1
+        else:
+            lt, eq, gt = jump
+            taken = np.zeros(len(out), dtype=bool)
+            if lt:
+                taken |= out < 0
+            if eq:
+                taken |= out == 0
+            if gt:
+                taken |= out > 0
+            self.pc[machines] = np.where(taken, ram_address, address + 1)
+
+        if dest & cpu.DEST_A:
+            self.a[machines] = out
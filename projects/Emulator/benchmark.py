@@ -0,0 +1,298 @@
+"""
+Benchmarks for the emulator, every benchmark reports its throughput per second.
+We can run the benchmarks in following ways
+    python3 benchmark.py
+    python3 benchmark.py program.hack --cycles 10000000
+    python3 benchmark.py --only engines
+    python3 benchmark.py --only batch --machines 1 100 10000
+    python3 benchmark.py --only snapshot --cycles 5000000
+    python3 benchmark.py --only screen --cycles 20000000 --frame-every 100000
+    python3 benchmark.py --only trace
+    python3 benchmark.py --only input --cycles 30000000
+    python3 benchmark.py --only fusion
+
+By
+    Naresh Joshi
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import keyboard
+import screen
+from batch import BatchCPU
+from blocks import BlockCPU
+from cpu import CPU, assembler
+from emulator import load_program
+from fusion import FusedCPU
+from snapshot import restore_snapshot, save_snapshot
+from tracer import TracingCPU
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_PROGRAM = os.path.join(PROJECTS, '06', 'pong', 'Pong.asm')
+
+# Output of this repo's VM translator, the fusion benchmark counts its dispatches
+TRANSLATED_PROGRAMS = os.path.join(PROJECTS, 'Translator', '0[78]', '*', '*', '*.asm')
+
+# R2 = R0 * R1 by repeated addition, the batch benchmark runs it for a different R0, R1 pair on every machine
+MULTIPLY = """
+    @R2
+    M=0
+    @R1
+    D=M
+    @R3
+    M=D
+(LOOP)
+    @R3
+    D=M
+    @END
+    D;JLE
+    @R0
+    D=M
+    @R2
+    M=D+M
+    @R3
+    M=M-1
+    @LOOP
+    0;JMP
+(END)
+"""
+
+
+# A Pong session moving the bat back and forth, the input benchmark replays it
+PONG_SESSION = """
+5000000 LEFT
++1500000 0
++500000 RIGHT
++3000000 0
++500000 LEFT
++1000000 0
++2000000 RIGHT
++800000 0
++1000000 LEFT
++2500000 0
++500000 RIGHT
++1000000 0
+"""
+
+
+def run():
+    args = parse_args()
+
+    for name in args.only or BENCHMARKS:
+        BENCHMARKS[name](args)
+        print()
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Emulator benchmarks')
+    arg_parser.add_argument('program', nargs='?', default=DEFAULT_PROGRAM)
+    arg_parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='benchmarks to run, all by default')
+    arg_parser.add_argument('--cycles', type=int, default=3_000_000, help='cycles every engine runs')
+    arg_parser.add_argument('--machines', type=int, nargs='+', default=[1, 10, 100, 1000],
+                            help='machine counts of the batch benchmark')
+    arg_parser.add_argument('--frame-every', type=int, default=50_000, help='cycles between screen captures')
+    return arg_parser.parse_args()
+
+
+def benchmark_engines(args):
+    words = load_program(args.program)
+    print(f'engines : {args.program}, {len(words)} words, {args.cycles} cycles')
+
+    interpreter = CPU(words)
+    _, seconds = measure(interpreter.run, args.cycles)
+    report('interpreter', args.cycles, seconds)
+
+    # The first run compiles the blocks it enters, the second one runs on the cached blocks of the ROM
+    for name in ('blocks, compiling', 'blocks, cached'):
+        blocks = BlockCPU(words)
+        _, block_seconds = measure(blocks.run, args.cycles)
+        if (blocks.a, blocks.d, blocks.pc, blocks.ram) != \
+                (interpreter.a, interpreter.d, interpreter.pc, interpreter.ram):
+            raise Exception('Error in - compiled blocks do not end in the state of the interpreter')
+        report(name, args.cycles, block_seconds)
+        print(f'Speedup : {seconds / block_seconds:.2f}x')
+
+
+def benchmark_batch(args):
+    words = assembler.assemble(MULTIPLY)
+    print('batch : R0 * R1 by repeated addition, R0 and R1 random in 0 to 99')
+
+    random = np.random.default_rng(0)
+    for machines in args.machines:
+        inputs = random.integers(0, 100, (machines, 2))
+
+        def run_serial():
+            cycles = 0
+            for r0, r1 in inputs:
+                cpu.a = cpu.d = cpu.pc = 0
+                cpu.ram[0], cpu.ram[1] = r0, r1
+                cycles += cpu.run(args.cycles)[1]
+            return cycles
+
+        # Both sides are set up outside the measurement, first touching the RAM of many machines is not emulation
+        cpu = CPU(words)
+        batch = BatchCPU(words, machines)
+        batch.ram[:, :2] = inputs
+
+        cycles, serial_seconds = measure(run_serial)
+        _, seconds = measure(batch.run, args.cycles)
+        if not (batch.ram[:, 2] == inputs[:, 0] * inputs[:, 1]).all() or batch.cycles.sum() != cycles:
+            raise Exception(f'Error in - batch of {machines} machines does not match the serial runs')
+
+        report(f'{machines:>6} machines, serial', machines, serial_seconds, 'vectors')
+        report(f'{machines:>6} machines, lock step', machines, seconds, 'vectors')
+        print(f'Speedup : {serial_seconds / seconds:.2f}x, {cycles / seconds:,.0f} instructions/s')
+
+
+def benchmark_snapshot(args):
+    words = load_program(args.program)
+    print(f'snapshot : {args.program} booted for {args.cycles} cycles, then forked for {args.cycles} more')
+
+    def boot():
+        machine = BlockCPU(words)
+        machine.run(args.cycles)
+        return machine
+
+    booted, boot_seconds = measure(boot)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        snapshot_file = os.path.join(temp_dir, 'booted.snapshot')
+        _, save_seconds = measure(save_snapshot, snapshot_file, booted)
+
+        forked = BlockCPU(words)
+        _, restore_seconds = measure(restore_snapshot, snapshot_file, forked)
+
+        booted.run(args.cycles)
+        forked.run(args.cycles)
+        if (forked.a, forked.d, forked.pc, forked.cycles, list(forked.ram)) != \
+                (booted.a, booted.d, booted.pc, booted.cycles, list(booted.ram)):
+            raise Exception('Error in - the run forked from the snapshot does not match the original run')
+        del forked
+
+    print(f'{"boot":<30} {boot_seconds * 1000:8.3f} ms')
+    print(f'{"save snapshot":<30} {save_seconds * 1000:8.3f} ms')
+    print(f'{"restore snapshot":<30} {restore_seconds * 1000:8.3f} ms')
+    print(f'Speedup : {boot_seconds / restore_seconds:.0f}x')
+
+
+def benchmark_screen(args):
+    words = load_program(args.program)
+    print(f'screen : {args.program} captured every {args.frame_every} cycles for {args.cycles} cycles')
+
+    every_row = np.arange(screen.ROWS)
+
+    def record(name, path, frame_format, changed_only=True):
+        machine = BlockCPU(words)
+        tracker = screen.ScreenTracker(machine)
+        exporter = screen.FrameExporter(path, frame_format)
+        frames = 0
+        export_seconds = 0
+        for _ in range(0, args.cycles, args.frame_every):
+            machine.run(args.frame_every)
+            start = time.perf_counter()
+            frame, rows = tracker.capture()
+            exporter.export(machine.cycles, frame, rows if changed_only else every_row)
+            export_seconds += time.perf_counter() - start
+            frames += 1
+        exporter.close()
+
+        paths = [entry.path for entry in os.scandir(path)] if os.path.isdir(path) else [path]
+        size = sum(os.path.getsize(name) for name in paths)
+        print(f'{name:<30} {export_seconds * 1000:8.1f} ms {exporter.frames:5} of {frames} frames {size:12,} bytes')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        record('every frame as PBM', os.path.join(temp_dir, 'every'), 'pbm', changed_only=False)
+        record('changed frames as PBM', os.path.join(temp_dir, 'changed'), 'pbm')
+        record('changed frames as PNG', os.path.join(temp_dir, 'png'), 'png')
+        record('delta stream', os.path.join(temp_dir, 'frames.delta'), 'delta')
+
+
+def benchmark_trace(args):
+    words = load_program(args.program)
+    print(f'trace : {args.program}, {args.cycles} cycles')
+
+    interpreter = CPU(words)
+    _, seconds = measure(interpreter.run, args.cycles)
+    report('interpreter', args.cycles, seconds)
+
+    machine = TracingCPU(words)
+    _, trace_seconds = measure(machine.run, args.cycles)
+    report('interpreter, tracing', args.cycles, trace_seconds)
+    if (machine.a, machine.d, machine.pc, machine.ram) != \
+            (interpreter.a, interpreter.d, interpreter.pc, interpreter.ram):
+        raise Exception('Error in - the tracing interpreter does not end in the state of the interpreter')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_file = os.path.join(temp_dir, 'run.trace')
+        records, flush_seconds = measure(machine.flush, trace_file)
+        print(f'{"flush":<30} {flush_seconds * 1000:8.3f} ms {records} records, {os.path.getsize(trace_file):,} bytes')
+    print(f'Overhead : {trace_seconds / seconds:.2f}x')
+
+
+def benchmark_input(args):
+    words = load_program(args.program)
+    events = keyboard.parse_input_script(PONG_SESSION)
+    print(f'input : {args.program} replaying {len(events)} key events over {args.cycles} cycles')
+
+    sessions = []
+    for name in ('session', 'session, replayed'):
+        machine = BlockCPU(words)
+        input_script = keyboard.InputScript(events)
+        (status, cycles), seconds = measure(input_script.run, machine, args.cycles)
+        report(f'{name}, {status}', cycles, seconds)
+        sessions.append((machine.a, machine.d, machine.pc, machine.cycles, machine.ram))
+    if sessions[0] != sessions[1]:
+        raise Exception('Error in - the replayed session does not end in the state of the first one')
+
+
+def benchmark_fusion(args):
+    words = load_program(args.program)
+    print(f'fusion : {args.program}, {len(words)} words, {args.cycles} cycles')
+
+    interpreter = CPU(words)
+    _, seconds = measure(interpreter.run, args.cycles)
+    report('interpreter', args.cycles, seconds)
+
+    machine, decode_seconds = measure(FusedCPU, words)
+    _, fused_seconds = measure(machine.run, args.cycles)
+    report('fused', args.cycles, fused_seconds)
+    if (machine.a, machine.d, machine.pc, machine.ram) != \
+            (interpreter.a, interpreter.d, interpreter.pc, interpreter.ram):
+        raise Exception('Error in - the fused interpreter does not end in the state of the interpreter')
+    print(f'{"fuse ROM":<30} {decode_seconds * 1000:8.1f} ms')
+    print(f'Speedup : {seconds / fused_seconds:.2f}x, {args.cycles / machine.dispatches:.2f} instructions per dispatch')
+
+    # Every translated test program runs to its final loop, dispatches are compared to the instructions executed
+    for asm_file in sorted(glob.glob(TRANSLATED_PROGRAMS)):
+        machine = FusedCPU(load_program(asm_file))
+        status, cycles = machine.run(args.cycles)
+        print(f'{os.path.basename(asm_file):<30} {cycles:8} instructions {machine.dispatches:8} dispatches '
+              f'{cycles / machine.dispatches:6.2f}x fewer')
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def report(name, count, seconds, unit='instructions'):
+    print(f'{name:<30} {seconds:8.3f} s {count / seconds:14,.0f} {unit}/s')
+
+
+BENCHMARKS = {
+    'engines': benchmark_engines,
+    'batch': benchmark_batch,
+    'snapshot': benchmark_snapshot,
+    'screen': benchmark_screen,
+    'trace': benchmark_trace,
+    'input': benchmark_input,
+    'fusion': benchmark_fusion
+}
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,272 @@
+"""
+Basic block compiler for the HACK CPU emulator. A block runs from the address it is entered at up to and including
+its first jump, it is compiled on first entry to a Python function over the locals A and D that returns the new A, D
+and PC. Blocks are looked up by their entry address, so a jump into the middle of a block simply compiles another
+block starting there. Compiled blocks are shared by every CPU running the same ROM.
+By
+    Naresh Joshi
+"""
+from array import array
+
+import cpu
+
+# Longest block compiled, it bounds the cycles a block can overshoot the budget by before the interpreter takes over
+MAX_BLOCK = 256
+
+# Runs of at least this many cycles execute on a list copy of the RAM, list subscripts are several times faster than
+# array ones and copying the RAM in and out costs about as much as running 30000 instructions
+LIST_RAM_CYCLES = 1 << 18
+
+# Python expressions of the ALU functions over a, d and m, the ones that can leave the 16 bit range are wrapped
+comp_expressions = {
+    '0': '0',
+    '1': '1',
+    '-1': '-1',
+    'D': '{d}',
+    'A': '{a}', 'M': '{m}',
+    '!D': '~{d}',
+    '!A': '~{a}', '!M': '~{m}',
+    '-D': '-{d}',
+    '-A': '-{a}', '-M': '-{m}',
+    'D+1': '{d} + 1',
+    'A+1': '{a} + 1', 'M+1': '{m} + 1',
+    'D-1': '{d} - 1',
+    'A-1': '{a} - 1', 'M-1': '{m} - 1',
+    'D+A': '{d} + {a}', 'D+M': '{d} + {m}',
+    'D-A': '{d} - {a}', 'D-M': '{d} - {m}',
+    'A-D': '{a} - {d}', 'M-D': '{m} - {d}',
+    'D&A': '{d} & {a}', 'D&M': '{d} & {m}',
+    'D|A': '{d} | {a}', 'D|M': '{d} | {m}'
+}
+
+unwrapped_comps = {'0', '1', '-1', 'D', 'A', 'M', '!D', '!A', '!M', 'D&A', 'D&M', 'D|A', 'D|M'}
+
+jump_expressions = {
+    0b001: '{x} > 0',
+    0b010: '{x} == 0',
+    0b011: '{x} >= 0',
+    0b100: '{x} < 0',
+    0b101: '{x} != 0',
+    0b110: '{x} <= 0',
+    0b111: None
+}
+
+# Compiled blocks by ROM hash, each maps an entry address to the block function, the most instructions it runs and
+# its exits that end a full pass of an idle loop
+block_caches = {}
+
+
+def block_source(words, start, loops=None):
+    """
+    Generate the source of the block entered at start, returns it with the most instructions the block can execute.
+    A block carries on past conditional jumps, which leave it early when taken, and follows unconditional jumps to
+    constant targets other than its own start and the start of an idle loop, it ends at a jump to a computed target
+    or one of those, at MAX_BLOCK instructions or at the end of the ROM. Also returns the exits that end a full pass
+    of an idle loop as (target, instruction count) pairs
+    """
+    loops = loops or {}
+    idle_starts = {target for target, reads_input in loops.values()}
+    full_passes = set()
+    segment = start
+    code = BlockCode()
+    a = ('a', 0)
+    d = ('d', 0)
+    address = start
+    count = 0
+    while count < MAX_BLOCK and address < len(words):
+        word = words[address]
+        address += 1
+        count += 1
+        if not word & 0x8000:
+            a = (None, word)
+            continue
+
+        comp = cpu.comp_codes.get((word >> 6) & 0x7F)
+        if comp is None:
+            raise Exception(f'Error at address {address - 1}, {word:016b} is not a valid instruction')
+        dest = (word >> 3) & 0b111
+        jump = word & 0b111
+
+        registers = {'A': a, 'D': d}
+        if 'M' in comp:
+            registers['M'] = (code.assign(f'ram[{code.value(a)}]'), 0)
+        out = code.alu(comp, registers)
+
+        if dest & cpu.DEST_M:
+            code.lines.append(f'ram[{code.value(a)}] = {code.value(out)}')
+        # The jump target is A before this instruction writes it
+        target = a
+        if dest & cpu.DEST_D:
+            d = out
+        if dest & cpu.DEST_A:
+            a = out
+        if not jump:
+            continue
+        target = target[1] & 0x7FFF if target[0] is None else f'{code.value(target)} & 32767'
+
+        condition = jump_expressions.get(jump)
+        if condition is not None:
+            condition = condition.format(x=code.value(out))
+            # A jump on a constant is always or never taken
+            if out[0] is None:
+                if not eval(condition):
+                    continue
+                condition = None
+        # A block entered at the jump of an idle loop does not know its target and can not run a full pass of it
+        if address - 1 in loops and isinstance(target, int) and segment <= target:
+            full_passes.add((target, count))
+        if condition is not None:
+            exit_lines = []
+            returned = f'{code.value(a, exit_lines)}, {code.value(d, exit_lines)}, {target}, {count}'
+            code.lines.append(f'if {condition}:')
+            code.lines += [f'    {line}' for line in exit_lines + [f'return {returned}']]
+        elif isinstance(target, int) and target != start and target not in idle_starts:
+            address = segment = target
+        else:
+            code.lines.append(f'return {code.value(a)}, {code.value(d)}, {target}, {count}')
+            break
+    else:
+        code.lines.append(f'return {code.value(a)}, {code.value(d)}, {address}, {count}')
+
+    body = '\n    '.join(code.lines)
+    return f'def block_{start}(ram, a, d):\n    {body}\n', count, frozenset(full_passes)
+
+
+class BlockCode:
+    """
+    The lines of a block function being generated. A and D are tracked as (local, offset) pairs, the local is None
+    for a constant, so the stack pointer arithmetic of translated code only moves offsets and a register is wrapped
+    into a local of its own when a RAM address, a store, an ALU input or an exit needs it. Every local is assigned
+    once, so a wrapped sum stays valid for the rest of the block
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.wrapped = {}
+        self.locals = 0
+
+    def assign(self, expression, lines=None):
+        lines = self.lines if lines is None else lines
+        self.locals += 1
+        local = f't{self.locals}'
+        lines.append(f'{local} = {expression}')
+        return local
+
+    def value(self, register, lines=None):
+        """
+        The register as a literal or a local, sums wrapped inside a conditional exit are not reused after it
+        """
+        local, offset = register
+        if local is None:
+            return str(offset)
+        if not offset:
+            return local
+        if register in self.wrapped:
+            return self.wrapped[register]
+
+        reused = lines is None
+        lines = self.lines if reused else lines
+        # The local is in the 16 bit range, so the sum can only leave it on the side the offset moves it to
+        total = self.assign(f'{local} + {offset}' if offset > 0 else f'{local} - {-offset}', lines)
+        if offset > 0:
+            lines.append(f'if {total} > 32767: {total} -= 65536')
+        else:
+            lines.append(f'if {total} < -32768: {total} += 65536')
+        if reused:
+            self.wrapped[register] = total
+        return total
+
+    def alu(self, comp, registers):
+        """
+        The output of an ALU function as a (local, offset) pair, constant inputs are folded and adding a constant only
+        moves the offset
+        """
+        inputs = [registers[name] for name in comp if name in registers]
+        if all(local is None for local, offset in inputs):
+            a, d, m = (registers.get(name, (None, 0))[1] for name in 'ADM')
+            return None, cpu.operations[comp](a, d, m)
+        if comp in registers:
+            return registers[comp]
+        if comp[1:] in ('+1', '-1'):
+            return add_constant(registers[comp[0]], int(comp[1:]))
+
+        x = inputs[0]
+        if len(inputs) == 1:
+            if comp[0] == '!':
+                return self.assign(f'~{self.value(x)}'), 0
+            # Only the negation of -32768 leaves the range
+            total = self.assign(f'-{self.value(x)}')
+            self.lines.append(f'if {total} > 32767: {total} = -32768')
+            return total, 0
+
+        y = inputs[1]
+        operator = comp[1]
+        if operator == '+' and None in (x[0], y[0]):
+            return add_constant(x, y[1]) if y[0] is None else add_constant(y, x[1])
+        if operator == '-' and y[0] is None:
+            return add_constant(x, -y[1])
+        total = self.assign(f'{self.value(x)} {operator} {self.value(y)}')
+        if operator in '+-':
+            self.lines.append(f'if {total} > 32767: {total} -= 65536')
+            self.lines.append(f'elif {total} < -32768: {total} += 65536')
+        return total, 0
+
+
+def add_constant(register, constant):
+    local, offset = register
+    return local, cpu.wrap(offset + constant)
+
+
+def compile_block(words, start, loops=None):
+    source, length, full_passes = block_source(words, start, loops)
+    namespace = {}
+    exec(compile(source, f'<block {start}>', 'exec'), namespace)
+    return namespace[f'block_{start}'], length, full_passes
+
+
+class BlockCPU(cpu.CPU):
+    """
+    A CPU that runs compiled basic blocks, the interpreter of the plain CPU finishes a run when the next block would
+    overshoot the cycle budget
+    """
+
+    def __init__(self, words):
+        super().__init__(words)
+        self.blocks = block_caches.setdefault(cpu.rom_hash(self.words), {})
+        self.idle_starts = {target: jump_address for jump_address, (target, reads_input) in self.loops.items()}
+
+    def run(self, max_cycles):
+        blocks = self.blocks
+        idle_starts = self.idle_starts
+        words = self.words
+        ram = self.ram.tolist() if max_cycles >= LIST_RAM_CYCLES else self.ram
+        a = self.a
+        d = self.d
+        pc = self.pc
+
+        cycles = 0
+        jump_address = None
+        while True:
+            block = blocks.get(pc)
+            if block is None:
+                if pc >= len(words):
+                    break
+                block = blocks[pc] = compile_block(words, pc, self.loops)
+
+            function, length, full_passes = block
+            if cycles + length > max_cycles:
+                break
+            a, d, pc, executed = function(ram, a, d)
+            cycles += executed
+            if pc in idle_starts and (pc, executed) in full_passes:
+                jump_address = idle_starts[pc]
+                break
+
+        if ram is not self.ram:
+            self.ram[:] = array('h', ram)
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        if jump_address is not None:
+            return self.idle(jump_address, max_cycles - cycles, cycles)
+        status, remaining = super().run(max_cycles - cycles)
+        return status, cycles + remaining
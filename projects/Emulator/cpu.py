@@ -0,0 +1,288 @@
+"""
+HACK CPU emulator core, every ROM word is decoded once into a tuple of its fields and the fetch loop runs over that
+table keeping A, D and PC in locals. RAM is an array of signed 16 bit words, so every value the program sees is the
+signed value the HACK ALU works with.
+By
+    Naresh Joshi
+"""
+import hashlib
+import os
+import sys
+from array import array
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Assembler'))
+
+import assembler
+
+RAM_SIZE = 1 << 15
+SCREEN = 16384
+SCREEN_SIZE = 8192
+KBD = 24576
+
+# Run statuses, a run stops when its budget is spent, when the program counter leaves the ROM, when the program is
+# caught in a loop that never changes anything and when it waits for a key that is never going to come
+BUDGET = 'budget'
+END = 'end'
+HALTED = 'halted'
+WAITING = 'waiting'
+
+# Internal status of a run that has detected an idle loop
+IDLE = 'idle'
+
+# Destination bits of a decoded C-instruction
+DEST_M = 1
+DEST_D = 2
+DEST_A = 4
+
+
+def wrap(value):
+    """
+    Wrap an integer to the signed 16 bit range
+    """
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+# ALU functions of A, D and M by their assembly mnemonic, bitwise results of signed 16 bit inputs stay in range
+operations = {
+    '0': lambda a, d, m: 0,
+    '1': lambda a, d, m: 1,
+    '-1': lambda a, d, m: -1,
+    'D': lambda a, d, m: d,
+    'A': lambda a, d, m: a, 'M': lambda a, d, m: m,
+    '!D': lambda a, d, m: ~d,
+    '!A': lambda a, d, m: ~a, '!M': lambda a, d, m: ~m,
+    '-D': lambda a, d, m: wrap(-d),
+    '-A': lambda a, d, m: wrap(-a), '-M': lambda a, d, m: wrap(-m),
+    'D+1': lambda a, d, m: wrap(d + 1),
+    'A+1': lambda a, d, m: wrap(a + 1), 'M+1': lambda a, d, m: wrap(m + 1),
+    'D-1': lambda a, d, m: wrap(d - 1),
+    'A-1': lambda a, d, m: wrap(a - 1), 'M-1': lambda a, d, m: wrap(m - 1),
+    'D+A': lambda a, d, m: wrap(d + a), 'D+M': lambda a, d, m: wrap(d + m),
+    'D-A': lambda a, d, m: wrap(d - a), 'D-M': lambda a, d, m: wrap(d - m),
+    'A-D': lambda a, d, m: wrap(a - d), 'M-D': lambda a, d, m: wrap(m - d),
+    'D&A': lambda a, d, m: d & a, 'D&M': lambda a, d, m: d & m,
+    'D|A': lambda a, d, m: d | a, 'D|M': lambda a, d, m: d | m
+}
+
+# The 7 comp bits of an instruction, a bit included, to its mnemonic
+comp_codes = {int(bits, 2): comp for comp, bits in assembler.computations.items()}
+
+# Jump bits to whether the jump is taken for a negative, zero and positive ALU output
+jump_conditions = {
+    0b001: (False, False, True),
+    0b010: (False, True, False),
+    0b011: (False, True, True),
+    0b100: (True, False, False),
+    0b101: (True, False, True),
+    0b110: (True, True, False),
+    0b111: (True, True, True)
+}
+
+
+def decode(word, address=0):
+    """
+    Decode a ROM word to (is A-instruction, value, comp function, reads M, dest bits, jump conditions), an
+    A-instruction only uses its value and a C-instruction that does not jump has no jump conditions
+    """
+    if not word & 0x8000:
+        return True, word, None, False, 0, None
+
+    comp = comp_codes.get((word >> 6) & 0x7F)
+    if comp is None:
+        raise Exception(f'Error at address {address}, {word:016b} is not a valid instruction')
+    return False, 0, operations[comp], 'M' in comp, (word >> 3) & 0b111, jump_conditions.get(word & 0b111)
+
+
+def rom_hash(words):
+    """
+    SHA-1 of the ROM words as little endian bytes
+    """
+    if sys.byteorder == 'big':
+        words = array('H', words)
+        words.byteswap()
+    return hashlib.sha1(memoryview(words).cast('B')).digest()
+
+
+def decode_rom(words):
+    return [decode(word, address) for address, word in enumerate(words)]
+
+
+def idle_loops(words):
+    """
+    Find the loops that can never change the machine state, a straight line of instructions from a jump target up to a
+    jump back to it that writes no RAM and writes every register before reading it. Every full pass through such a
+    loop repeats the one before, so once a full pass ends with its jump taken it is taken forever unless RAM changes
+    from outside. A run stops after the first full pass, one that ran through the loop from its start.
+    Returns {jump address: (target, reads input)}, a loop reads input when it may read the keyboard
+    """
+    loops = {}
+    for address, word in enumerate(words):
+        if word & 0x8000 and word & 0b111:
+            target = loop_target(words, address)
+            if target is not None:
+                reads_input = idle_loop_reads(words, target, address)
+                if reads_input is not None:
+                    loops[address] = target, reads_input
+    return loops
+
+
+def loop_target(words, jump_address):
+    """
+    The constant target of the jump when it is at or before the jump and no other jump comes in between
+    """
+    for address in range(jump_address - 1, -1, -1):
+        word = words[address]
+        if not word & 0x8000:
+            return word if word <= address and not any(words[i] & 0x8000 and words[i] & 0b111
+                                                       for i in range(word, address)) else None
+        if word & 0b111 or (word >> 3) & DEST_A:
+            return None
+    return None
+
+
+def idle_loop_reads(words, start, end):
+    """
+    Whether the loop from start to the jump at end may read the keyboard, None when the loop is not idle
+    """
+    written = set()
+    a_value = None
+    reads_input = False
+    for word in words[start:end + 1]:
+        if not word & 0x8000:
+            written.add('A')
+            a_value = word
+            continue
+
+        comp = comp_codes[(word >> 6) & 0x7F]
+        dest = (word >> 3) & 0b111
+        reads = {register for register in 'AD' if register in comp}
+        if 'M' in comp or word & 0b111:
+            reads.add('A')
+        if dest & DEST_M or not reads <= written:
+            return None
+
+        if 'M' in comp and (a_value is None or a_value == KBD):
+            reads_input = True
+        if dest & DEST_D:
+            written.add('D')
+        if dest & DEST_A:
+            written.add('A')
+            a_value = None
+    return reads_input
+
+
+def ends_full_pass(loops, jump_address, last_target, target):
+    """
+    Whether a taken jump ends a full pass of an idle loop, it jumps back to the start of the loop and execution has run
+    from the last jump target, or the start of the run, at or before the start straight through to the jump. A run
+    entered at the jump itself may hold any target in A. Every engine checks its taken jumps here, with A already
+    written by the jump instruction
+    """
+    loop = loops.get(jump_address)
+    return loop is not None and last_target <= target == loop[0]
+
+
+class CPU:
+    """
+    A HACK computer, the ROM is decoded when it is loaded and the registers and RAM survive between runs so that a
+    program can be run in slices of cycles
+    """
+
+    def __init__(self, words):
+        self.words = array('H', words)
+        self.rom = decode_rom(self.words)
+        self.loops = idle_loops(self.words)
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+
+        # Set while a key press is queued for a later cycle, a loop waiting on the keyboard is then fast forwarded to
+        # the end of the run instead of stopping it
+        self.input_queued = False
+        # Set when every run must spend its whole budget like a test script's repeat, idle loops are then fast
+        # forwarded to the end of the run whatever they wait for
+        self.run_to_budget = False
+
+    def reset(self):
+        self.pc = 0
+
+    def run(self, max_cycles):
+        """
+        Execute until the cycle budget is spent, the program counter leaves the ROM or the program idles in a loop,
+        returns the run status and the cycles it executed
+        """
+        rom = self.rom
+        ram = self.ram
+        loops = self.loops
+        a = self.a
+        d = self.d
+        pc = self.pc
+
+        status = BUDGET
+        cycles = 0
+        # Execution runs in a straight line from the last jump target, or the start of the run, up to the next jump
+        last_target = pc
+        try:
+            for cycles in range(max_cycles):
+                is_address, value, comp, reads_m, dest, jump = rom[pc]
+                if is_address:
+                    a = value
+                    pc += 1
+                    continue
+
+                out = comp(a, d, ram[a] if reads_m else 0)
+                if dest & DEST_M:
+                    ram[a] = out
+                if dest & DEST_D:
+                    d = out
+
+                # The jump target and the M address are A as it was before this instruction, the program counter is
+                # 15 bits wide like the ROM address
+                if jump is not None and jump[(out > 0) - (out < 0) + 1]:
+                    target = a & 0x7FFF
+                    if dest & DEST_A:
+                        a = out
+                    if ends_full_pass(loops, pc, last_target, target):
+                        jump_address = pc
+                        status = IDLE
+                        pc = target
+                        cycles += 1
+                        break
+                    last_target = pc = target
+                    continue
+                pc += 1
+                if dest & DEST_A:
+                    a = out
+            else:
+                cycles = max_cycles
+        except IndexError:
+            status = END
+
+        if pc >= len(rom):
+            status = END
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        if status == IDLE:
+            return self.idle(jump_address, max_cycles - cycles, cycles)
+        return status, cycles
+
+    def idle(self, jump_address, remaining, cycles):
+        """
+        The program has just completed a full pass of an idle loop and jumped back to its start. It halts there, or
+        waits for a key that is not queued, or skips whole passes up to the end of the run when a key is queued or the
+        run has to spend its budget
+        """
+        target, reads_input = self.loops[jump_address]
+        if not reads_input and not self.run_to_budget:
+            return HALTED, cycles
+        if not self.input_queued and not self.run_to_budget:
+            return WAITING, cycles
+
+        passes = remaining // (jump_address - target + 1)
+        skipped = passes * (jump_address - target + 1)
+        self.cycles += skipped
+        status, executed = self.run(remaining - skipped)
+        return status, cycles + skipped + executed
+
@@ -0,0 +1,165 @@
+"""
+Headless HACK CPU emulator, it runs .hack, packed .rom and .asm programs for a budget of cycles.
+We can run the emulator in following ways
+    python3 emulator.py program.hack
+    python3 emulator.py program.rom --cycles 10000000
+    python3 emulator.py Mult.asm --set 0=6 1=7 --show 2
+    python3 emulator.py program.hack --engine blocks
+    python3 emulator.py program.asm --engine fused
+    python3 emulator.py program.asm --profile --folded program.folded
+    python3 emulator.py program.hack --cycles 5000000 --snapshot booted.snapshot
+    python3 emulator.py program.hack --restore booted.snapshot
+    python3 emulator.py program.hack --cycles 10000000 --frames frames --frame-every 100000
+    python3 emulator.py program.hack --frames program.frames --frame-format delta
+    python3 emulator.py program.asm --trace program.trace --trace-records 4096
+    python3 emulator.py Pong.asm --cycles 50000000 --engine blocks --input session.keys --frames session.delta
+
+RAM values are given and shown as signed 16 bit integers.
+By
+    Naresh Joshi
+"""
+import argparse
+import functools
+import os
+import time
+
+import keyboard
+import profiler
+import screen
+import tracer
+from blocks import BlockCPU
+from cpu import CPU, END, assembler
+from fusion import FusedCPU
+from snapshot import restore_snapshot, save_snapshot
+
+ENGINES = {
+    'interpreter': CPU,
+    'blocks': BlockCPU,
+    'fused': FusedCPU
+}
+
+
+def run():
+    args = parse_args()
+
+    print(f"Loading program {args.program}")
+    if args.profile:
+        source_map = profiler.load_source_map(args.program)
+        cpu = profiler.ProfilingCPU(load_program(args.program), source_map)
+    elif args.trace:
+        cpu = tracer.TracingCPU(load_program(args.program), args.trace_records, args.trace)
+    else:
+        cpu = ENGINES[args.engine](load_program(args.program))
+    if args.restore:
+        restore_snapshot(args.restore, cpu)
+        print(f"Restored snapshot {args.restore} at cycle {cpu.cycles}")
+    for address, value in args.set:
+        cpu.ram[address] = value
+
+    run_cpu = cpu.run
+    if args.frames:
+        exporter = screen.FrameExporter(args.frames, args.frame_format)
+        run_cpu = functools.partial(screen.record_frames, cpu, every=args.frame_every, exporter=exporter,
+                                    tracker=screen.ScreenTracker(cpu))
+    input_script = keyboard.read_input_script(args.input) if args.input else None
+
+    start = time.perf_counter()
+    if input_script:
+        status, cycles = input_script.run(cpu, args.cycles, run_cpu)
+    else:
+        status, cycles = run_cpu(args.cycles)
+    seconds = time.perf_counter() - start
+    if args.frames:
+        exporter.close()
+
+    print(f'Executed {cycles} cycles in {seconds:.3f} s, {cycles / max(seconds, 1e-9) / 1e6:.2f} MHz, '
+          f'{status} at pc {cpu.pc}')
+    print(f'A = {cpu.a}, D = {cpu.d}')
+    if input_script:
+        print(f'Replayed {input_script.replayed} of {len(input_script.events)} input events')
+    for address in args.show:
+        print(f'RAM[{address}] = {cpu.ram[address]}')
+
+    if args.trace:
+        if status == END or args.flush_trace:
+            if status != END:
+                cpu.flush(args.trace)
+            print(f"Written trace file {args.trace}, read it with tracer.py")
+    if args.frames:
+        print(f"Written {exporter.frames} changed frames, {exporter.rows} rows, to {args.frames}")
+    if args.snapshot:
+        save_snapshot(args.snapshot, cpu)
+        print(f"Written snapshot file {args.snapshot}")
+
+    if args.profile:
+        print()
+        print(profiler.hot_spot_report(cpu.counts, source_map, cpu.stack_cycles))
+        if args.folded:
+            root = os.path.splitext(os.path.basename(args.program))[0]
+            profiler.generate_folded_stacks(args.folded, cpu.stack_cycles, root)
+            print(f"Written folded stacks file {args.folded}")
+
+
+def load_program(program_file):
+    """
+    Read the ROM words of a .hack, packed .rom or .asm file
+    """
+    if program_file.endswith('.rom'):
+        words, digest = assembler.load_rom(program_file)
+        return words
+    if program_file.endswith('.asm'):
+        with open(program_file) as file:
+            return assembler.assemble(file.read())
+    with open(program_file) as file:
+        return [int(line, 2) for line in file if line.strip()]
+
+
+def ram_assignment(text):
+    address, _, value = text.partition('=')
+    return int(address), int(value)
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Run HACK programs without the CPU emulator GUI')
+    arg_parser.add_argument('program', help='.hack, packed .rom or .asm file')
+    arg_parser.add_argument('--cycles', type=int, default=1_000_000, help='cycle budget of the run')
+    arg_parser.add_argument('--engine', choices=ENGINES, default='interpreter',
+                            help='decoded instruction interpreter or basic blocks compiled to Python')
+    arg_parser.add_argument('--set', type=ram_assignment, nargs='+', default=[], metavar='ADDRESS=VALUE',
+                            help='RAM values before the run')
+    arg_parser.add_argument('--show', type=int, nargs='+', default=[], metavar='ADDRESS',
+                            help='RAM addresses printed after the run')
+    arg_parser.add_argument('--restore', metavar='SNAPSHOT_FILE', help='start from a snapshot of the same ROM')
+    arg_parser.add_argument('--snapshot', metavar='SNAPSHOT_FILE', help='save a snapshot of the machine after the run')
+    arg_parser.add_argument('--input', metavar='INPUT_FILE', help='keyboard input script replayed during the run')
+    arg_parser.add_argument('--frames', metavar='PATH',
+                            help='export the screen whenever it changed, a directory of images or a delta stream file')
+    arg_parser.add_argument('--frame-every', type=int, default=100_000, metavar='CYCLES',
+                            help='cycles between screen captures')
+    arg_parser.add_argument('--frame-format', choices=screen.FRAME_FORMATS, default='pbm',
+                            help='PBM or PNG image sequence or a delta stream of the changed rows')
+    arg_parser.add_argument('--trace', metavar='TRACE_FILE',
+                            help='keep a ring buffer of the last instructions, it is written when the run faults, it '
+                                 'runs on the interpreter')
+    arg_parser.add_argument('--trace-records', type=int, default=tracer.TRACE_RECORDS,
+                            help='instructions kept by --trace')
+    arg_parser.add_argument('--flush-trace', action='store_true', help='write the trace at the end of any run')
+    arg_parser.add_argument('--profile', action='store_true',
+                            help='count the executions of every address and print a hot spot report, it runs on the '
+                                 'interpreter with the source map of the program')
+    arg_parser.add_argument('--folded', help='folded call stacks file written by --profile for flamegraph tools')
+
+    args = arg_parser.parse_args()
+    if args.folded and not args.profile:
+        arg_parser.error('--folded is written by --profile')
+    if args.trace and args.profile:
+        arg_parser.error('--trace and --profile run different interpreters')
+    if args.flush_trace and not args.trace:
+        arg_parser.error('--flush-trace needs --trace')
+    if args.frame_every <= 0:
+        arg_parser.error('--frame-every must be positive')
+    return args
+
+
+if __name__ == '__main__':
+    run()
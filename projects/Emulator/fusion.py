@@ -0,0 +1,235 @@
+"""
+Superinstructions for the HACK CPU emulator. The stack idioms the VM translators emit over and over, pop to D, push D,
+a binary or unary operation on the top of the stack and an A-instruction with the C-instruction after it, are found in
+the ROM when it is decoded and every occurrence is dispatched as one fused handler. Handlers are generated from the
+block compiler's expressions once per shape, the words of the idiom with the constant of its A-instruction left open,
+and bound to the constant of every site.
+Every address keeps an entry of its own, so a jump into the middle of an idiom runs from there, on the entry for that
+address, and the fused handler at the start of the idiom is only ever entered at its first instruction.
+By
+    Naresh Joshi
+"""
+import cpu
+from blocks import comp_expressions, unwrapped_comps
+from cpu import assembler
+
+# Marks a fused entry of the decoded ROM, (FUSED, length, handler, None, 0, None)
+FUSED = 'fused'
+
+# Words of a pattern that match any C-instruction that does not jump and any A-instruction
+ANY_COMP = 'comp'
+ANY_ADDRESS = 'address'
+
+# Idioms of this repo's translator and of the standard one, longest first so that the longest one matching is fused
+PATTERNS = [
+    # push of a loaded value
+    '@* * @SP A=M M=D @SP M=M+1',
+    '@* * @SP AM=M+1 A=A-1 M=D',
+    # binary operation, this repo's translator clears the popped word
+    '@SP AM=M-1 D=M M=0 A=A-1 *',
+    '@SP AM=M-1 D=M A=A-1 *',
+    # push D
+    '@SP A=M M=D @SP M=M+1',
+    '@SP AM=M+1 A=A-1 M=D',
+    # pop to D
+    '@SP AM=M-1 D=M M=0',
+    '@SP AM=M-1 D=M',
+    # unary operation and comparison results
+    '@SP A=M-1 *',
+    # A-instruction with the C-instruction after it
+    '@* *'
+]
+
+# Most instructions a fused handler executes, the cycle budget left when a run finishes on the plain decoded ROM
+MAX_FUSED = 7
+
+# Handler factories by shape, shared by every ROM
+fused_factories = {}
+
+
+def pattern_words(pattern):
+    words = []
+    for token in pattern.split():
+        if token == '*':
+            words.append(ANY_COMP)
+        elif token == '@*':
+            words.append(ANY_ADDRESS)
+        else:
+            words.extend(assembler.assemble(token))
+    return words
+
+
+patterns = [pattern_words(pattern) for pattern in PATTERNS]
+
+
+def match(pattern, words, start):
+    """
+    The shape of the idiom when the pattern matches the words at start, None otherwise
+    """
+    if start + len(pattern) > len(words):
+        return None
+    shape = []
+    for expected, word in zip(pattern, words[start:start + len(pattern)]):
+        if expected == ANY_ADDRESS:
+            if word & 0x8000:
+                return None
+            shape.append(None)
+        elif expected == ANY_COMP:
+            if not word & 0x8000 or word & 0b111 or (word >> 6) & 0x7F not in cpu.comp_codes:
+                return None
+            shape.append(word)
+        elif word != expected:
+            return None
+        else:
+            shape.append(word)
+    return tuple(shape)
+
+
+def fused_source(shape):
+    """
+    Source of the factory of a shape, it takes the constant of the open A-instruction and returns the handler over
+    RAM, A and D that returns the new A and D
+    """
+    lines = []
+    a = 'a'
+    for word in shape:
+        if word is None:
+            a = 'k'
+            continue
+        if not word & 0x8000:
+            a = str(word)
+            continue
+
+        comp = cpu.comp_codes[(word >> 6) & 0x7F]
+        dest = (word >> 3) & 0b111
+        expression = comp_expressions[comp].format(a=a, d='d', m=f'ram[{a}]')
+        if comp not in unwrapped_comps:
+            expression = f'(({expression}) + 32768 & 65535) - 32768'
+        if bin(dest).count('1') > 1:
+            lines.append(f'x = {expression}')
+            expression = 'x'
+        if dest & cpu.DEST_M:
+            lines.append(f'ram[{a}] = {expression}')
+        if dest & cpu.DEST_D:
+            lines.append(f'd = {expression}')
+        if dest & cpu.DEST_A:
+            lines.append(f'a = {expression}')
+            a = 'a'
+    lines.append(f'return {a}, d')
+
+    body = '\n        '.join(lines)
+    return f'def factory(k):\n    def fused(ram, a, d):\n        {body}\n    return fused\n'
+
+
+def fused_handler(shape, words, start):
+    factory = fused_factories.get(shape)
+    if factory is None:
+        namespace = {}
+        exec(compile(fused_source(shape), f'<fused {start}>', 'exec'), namespace)
+        factory = fused_factories[shape] = namespace['factory']
+    # The constant of the open A-instruction, an idiom has at most one
+    constant = next((words[start + i] for i, word in enumerate(shape) if word is None), None)
+    return factory(constant)
+
+
+def fuse_rom(words, rom):
+    """
+    Decoded ROM with the entry of every address that starts an idiom replaced by its fused entry
+    """
+    fused = list(rom)
+    # Patterns that can start at a word, by word, most words start none of them
+    candidates = {}
+    for address, word in enumerate(words):
+        starting = candidates.get(word)
+        if starting is None:
+            starting = candidates[word] = [pattern for pattern in patterns
+                                           if pattern[0] == word or pattern[0] == ANY_ADDRESS and not word & 0x8000]
+        for pattern in starting:
+            shape = match(pattern, words, address)
+            if shape is not None:
+                fused[address] = FUSED, len(shape), fused_handler(shape, words, address), None, 0, None
+                break
+    return fused
+
+
+class FusedCPU(cpu.CPU):
+    """
+    A CPU that dispatches fused idioms as single handlers, the last cycles of a run, where a fused handler could
+    overshoot the cycle budget, run on the plain decoded ROM. dispatches counts the entries executed
+    """
+
+    def __init__(self, words):
+        super().__init__(words)
+        self.fused = fuse_rom(self.words, self.rom)
+        self.dispatches = 0
+
+    def run(self, max_cycles):
+        fused = self.fused
+        plain = self.rom
+        ram = self.ram
+        loops = self.loops
+        a = self.a
+        d = self.d
+        pc = self.pc
+
+        status = cpu.BUDGET
+        cycles = 0
+        last_target = pc
+        dispatch = extra = 0
+        try:
+            # A chunk is short enough that its dispatches can not overshoot the budget even if all of them are fused
+            while status == cpu.BUDGET and cycles < max_cycles:
+                if max_cycles - cycles >= MAX_FUSED:
+                    rom = fused
+                    chunk = (max_cycles - cycles) // MAX_FUSED
+                else:
+                    rom = plain
+                    chunk = max_cycles - cycles
+                extra = 0
+                for dispatch in range(chunk):
+                    is_address, value, comp, reads_m, dest, jump = rom[pc]
+                    if is_address:
+                        if is_address is FUSED:
+                            a, d = comp(ram, a, d)
+                            pc += value
+                            extra += value - 1
+                        else:
+                            a = value
+                            pc += 1
+                        continue
+
+                    out = comp(a, d, ram[a] if reads_m else 0)
+                    if dest & cpu.DEST_M:
+                        ram[a] = out
+                    if dest & cpu.DEST_D:
+                        d = out
+
+                    if jump is not None and jump[(out > 0) - (out < 0) + 1]:
+                        target = a & 0x7FFF
+                        if dest & cpu.DEST_A:
+                            a = out
+                        if cpu.ends_full_pass(loops, pc, last_target, target):
+                            jump_address = pc
+                            status = cpu.IDLE
+                            pc = target
+                            chunk = dispatch + 1
+                            break
+                        last_target = pc = target
+                        continue
+                    pc += 1
+                    if dest & cpu.DEST_A:
+                        a = out
+                cycles += chunk + extra
+                self.dispatches += chunk
+        except IndexError:
+            status = cpu.END
+            cycles += dispatch + extra
+            self.dispatches += dispatch
+
+        if pc >= len(plain):
+            status = cpu.END
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        if status == cpu.IDLE:
+            return self.idle(jump_address, max_cycles - cycles, cycles)
+        return status, cycles
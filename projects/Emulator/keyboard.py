@@ -0,0 +1,127 @@
+"""
+Scripted keyboard input for the HACK CPU emulator, so that interactive programs run the same way every time. An input
+script has an event per line, the key held down in the KBD register from then on
+    1000000 LEFT        at cycle 1000000 of the machine
+    +250000 0           250000 cycles after the previous event, 0 releases the key
+    poll a              as soon as the program waits for a key, in a loop that only reads the keyboard
+A key is a key code, a single character or the name of a special key of the HACK keyboard, # starts a comment.
+The machine runs in one slice of cycles per event, a program waiting for a key in between is fast forwarded to the
+event like a queued key press, so the script costs nothing per cycle.
+By
+    Naresh Joshi
+"""
+import cpu
+
+# Key codes of the special keys of the HACK keyboard
+KEYS = {
+    'RELEASE': 0,
+    'SPACE': 32,
+    'NEWLINE': 128, 'ENTER': 128,
+    'BACKSPACE': 129,
+    'LEFT': 130,
+    'UP': 131,
+    'RIGHT': 132,
+    'DOWN': 133,
+    'HOME': 134,
+    'END': 135,
+    'PAGEUP': 136,
+    'PAGEDOWN': 137,
+    'INSERT': 138,
+    'DELETE': 139,
+    'ESC': 140
+}
+KEYS.update((f'F{number}', 140 + number) for number in range(1, 13))
+
+# Event kinds, at a machine cycle, a number of cycles after the previous event and when the program waits for a key
+AT = 'at'
+AFTER = 'after'
+POLL = 'poll'
+
+
+def key_code(text):
+    if text.isdigit():
+        return int(text)
+    if len(text) == 1:
+        return ord(text)
+    if text.upper() in KEYS:
+        return KEYS[text.upper()]
+    raise Exception(f'Error in - {text} is not a key')
+
+
+def parse_input_script(text, name='input script'):
+    """
+    Parse an input script to a list of (kind, cycles, key code) events
+    """
+    events = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            when, key = line.split()
+            if when == 'poll':
+                events.append((POLL, 0, key_code(key)))
+            elif when.startswith('+'):
+                events.append((AFTER, int(when[1:]), key_code(key)))
+            else:
+                events.append((AT, int(when), key_code(key)))
+        except ValueError:
+            raise Exception(f'Error at line {line_number} of {name}, {line} is not a `cycle key`, `+cycles key` or '
+                            f'`poll key` event')
+    return events
+
+
+def read_input_script(input_file):
+    with open(input_file) as file:
+        return InputScript(parse_input_script(file.read(), input_file))
+
+
+class InputScript:
+    """
+    Events of an input script and the next one to replay, a script can be replayed over several runs of a machine
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.replayed = 0
+        self.last_event = None
+
+    def run(self, machine, max_cycles, run=None):
+        """
+        Run the machine for up to max_cycles cycles, pressing the keys of the events due in that time, returns the
+        run status and the cycles executed like a run of the machine. run is the function running the machine, as
+        one that also records its screen
+        """
+        run = run or machine.run
+        status = cpu.BUDGET
+        cycles = 0
+        while self.replayed < len(self.events) and cycles < max_cycles:
+            kind, when, key = self.events[self.replayed]
+            if self.last_event is None:
+                self.last_event = machine.cycles
+            if kind == POLL:
+                # The run stops waiting at the first loop that only reads the keyboard
+                machine.input_queued = False
+                status, executed = run(max_cycles - cycles)
+                cycles += executed
+                if status != cpu.WAITING:
+                    break
+            else:
+                due = when if kind == AT else self.last_event + when
+                machine.input_queued = True
+                status, executed = run(min(max(due - machine.cycles, 0), max_cycles - cycles))
+                cycles += executed
+                if machine.cycles < due:
+                    # The budget ran out or the program halted or left the ROM before the event
+                    break
+
+            machine.ram[cpu.KBD] = key
+            self.replayed += 1
+            self.last_event = machine.cycles
+            status = cpu.BUDGET
+        else:
+            machine.input_queued = False
+            if cycles < max_cycles:
+                status, executed = run(max_cycles - cycles)
+                cycles += executed
+        return status, cycles
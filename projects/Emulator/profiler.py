@@ -0,0 +1,198 @@
+"""
+Execution count profiler for HACK programs. The profiling CPU counts every executed ROM address in a preallocated array
+and follows the VM call protocol to keep a shadow call stack, a taken jump to a function entry while LCL and SP point
+at the same new frame is a call and a jump to the return address saved in that call's frame is its return. The counts
+are aggregated through the source map of the program by label, by `// vm command` region and by VM function, and the
+cycles of every call stack are written as folded stacks for flamegraph tools.
+By
+    Naresh Joshi
+"""
+import collections
+import os
+from array import array
+
+import cpu
+from cpu import assembler
+
+SP = 0
+LCL = 1
+
+# Entries every section of the hot spot report lists
+TOP = 20
+
+
+def load_source_map(program_file):
+    """
+    Source map entries of a program, built from the source of an .asm file and read from the .map file next to a
+    .hack or .rom file, an empty list when there is none
+    """
+    if program_file.endswith('.asm'):
+        return assembler.build_source_map(program_file)
+
+    map_file = os.path.splitext(program_file)[0] + '.map'
+    if os.path.exists(map_file):
+        return assembler.read_source_map(map_file)
+    return []
+
+
+def function_entries(source_map):
+    """
+    Addresses where a VM function starts, the first address under its function label
+    """
+    entries = {}
+    previous = None
+    for entry in source_map:
+        function = entry['function']
+        if function is not None and entry['label'] == function and previous != function:
+            entries[entry['address']] = function
+        previous = entry['label']
+    return entries
+
+
+class ProfilingCPU(cpu.CPU):
+    """
+    The interpreter with an execution counter per ROM address and a shadow call stack, the cycles spent under every
+    call stack are kept by the tuple of its function names
+    """
+
+    def __init__(self, words, source_map=()):
+        super().__init__(words)
+        self.counts = array('Q', bytes(8 * len(self.rom)))
+        self.entries = function_entries(source_map)
+        self.stack = []
+        self.stack_cycles = collections.Counter()
+
+    def run(self, max_cycles):
+        rom = self.rom
+        ram = self.ram
+        loops = self.loops
+        counts = self.counts
+        entries = self.entries
+        stack = self.stack
+        stack_cycles = self.stack_cycles
+        a = self.a
+        d = self.d
+        pc = self.pc
+
+        # Frames are (function, return address), the cycles of a stack are added up whenever it changes
+        functions = tuple(function for function, return_address in stack)
+        return_address = stack[-1][1] if stack else None
+        changed_at = 0
+
+        status = cpu.BUDGET
+        cycles = 0
+        last_target = pc
+        try:
+            for cycles in range(max_cycles):
+                counts[pc] += 1
+                is_address, value, comp, reads_m, dest, jump = rom[pc]
+                if is_address:
+                    a = value
+                    pc += 1
+                    continue
+
+                out = comp(a, d, ram[a] if reads_m else 0)
+                if dest & cpu.DEST_M:
+                    ram[a] = out
+                if dest & cpu.DEST_D:
+                    d = out
+
+                if jump is not None and jump[(out > 0) - (out < 0) + 1]:
+                    target = a & 0x7FFF
+                    if dest & cpu.DEST_A:
+                        a = out
+                    if cpu.ends_full_pass(loops, pc, last_target, target):
+                        jump_address = pc
+                        status = cpu.IDLE
+                        pc = target
+                        cycles += 1
+                        break
+                    last_target = pc = target
+                    # Loops back to a label at the start of a function land there with locals already pushed
+                    if pc in entries and ram[SP] == ram[LCL]:
+                        stack_cycles[functions] += cycles + 1 - changed_at
+                        changed_at = cycles + 1
+                        # The call protocol has set LCL to the new frame, the return address sits 5 words below it
+                        return_address = ram[ram[LCL] - 5]
+                        stack.append((entries[pc], return_address))
+                        functions += (entries[pc],)
+                    elif pc == return_address:
+                        stack_cycles[functions] += cycles + 1 - changed_at
+                        changed_at = cycles + 1
+                        stack.pop()
+                        functions = functions[:-1]
+                        return_address = stack[-1][1] if stack else None
+                    continue
+                pc += 1
+                if dest & cpu.DEST_A:
+                    a = out
+            else:
+                cycles = max_cycles
+        except IndexError:
+            status = cpu.END
+
+        if pc >= len(rom):
+            status = cpu.END
+        stack_cycles[functions] += cycles - changed_at
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        if status == cpu.IDLE:
+            # Passes skipped while waiting for a queued key are not counted
+            return self.idle(jump_address, max_cycles - cycles, cycles)
+        return status, cycles
+
+
+def aggregate(counts, source_map, field):
+    """
+    Add up the counts of the addresses by a field of their source map entries
+    """
+    totals = collections.Counter()
+    for entry in source_map:
+        count = counts[entry['address']]
+        if count:
+            totals[entry[field] or '(none)'] += count
+    return totals
+
+
+def hot_spot_report(counts, source_map, stack_cycles, top=TOP):
+    """
+    The text of the hot spot report, the busiest addresses, labels and vm commands and the functions that spent the
+    most cycles themselves, outside of their calls
+    """
+    total = sum(counts) or 1
+    lines = [f'{total} instructions executed']
+
+    by_address = {entry['address']: entry for entry in source_map}
+    lines.append('')
+    lines.append('Addresses')
+    busiest = sorted(range(len(counts)), key=counts.__getitem__, reverse=True)[:top]
+    for address in busiest:
+        if not counts[address]:
+            break
+        entry = by_address.get(address, {})
+        lines.append(f'{counts[address]:12} {100 * counts[address] / total:6.2f}% {address:6} '
+                     f'{entry.get("source", ""):<12} {entry.get("label") or ""}')
+
+    functions = collections.Counter()
+    for stack, cycles in stack_cycles.items():
+        functions[stack[-1] if stack else '(none)'] += cycles
+
+    sections = [('Labels', aggregate(counts, source_map, 'label')),
+                ('VM commands', aggregate(counts, source_map, 'vm')),
+                ('Functions', functions)]
+    for title, totals in sections:
+        lines.append('')
+        lines.append(title)
+        for name, count in totals.most_common(top):
+            lines.append(f'{count:12} {100 * count / total:6.2f}% {name}')
+    return '\n'.join(lines)
+
+
+def generate_folded_stacks(folded_file, stack_cycles, root):
+    """
+    Write the cycles of every call stack as `root;caller;callee cycles` lines
+    """
+    with open(folded_file, 'w') as file:
+        for functions, cycles in sorted(stack_cycles.items()):
+            if cycles:
+                file.write(f'{";".join((root,) + functions)} {cycles}\n')
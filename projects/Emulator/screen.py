@@ -0,0 +1,157 @@
+"""
+Screen capture of a HACK machine. The screen is RAM 16384 to 24575, 256 rows of 32 words with the least significant bit
+of a word as its leftmost pixel. A capture is a NumPy view over the RAM of the machine, no pixel is copied, and the rows
+that changed since the previous capture are found by comparing it with a copy of the captured rows. Tracking writes in
+the fetch loop itself would slow down every store of the emulator, a comparison of the 16 KB screen at every capture
+costs a few microseconds. Frames are exported as PBM or PNG image sequences holding only the frames that changed, or
+as a delta stream of the changed rows.
+By
+    Naresh Joshi
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import cpu
+
+ROWS = 256
+ROW_WORDS = 32
+WIDTH = 16 * ROW_WORDS
+
+DELTA_MAGIC = b'HSCR'
+
+# A delta stream frame starts with its cycle and changed row count, the row indexes and their 32 words follow
+DELTA_FRAME = struct.Struct('<QH')
+
+FRAME_FORMATS = ('pbm', 'png', 'delta')
+
+
+def screen_view(machine):
+    """
+    The screen of the machine as a (256, 32) int16 array sharing memory with its RAM
+    """
+    return np.frombuffer(machine.ram, dtype=np.int16, count=cpu.SCREEN_SIZE,
+                         offset=2 * cpu.SCREEN).reshape(ROWS, ROW_WORDS)
+
+
+def frame_pixels(frame):
+    """
+    The pixels of a frame as a (256, 512) array of 0 for white and 1 for black
+    """
+    data = np.ascontiguousarray(frame, dtype='<i2').view(np.uint8)
+    return np.unpackbits(data, axis=1, bitorder='little')
+
+
+class ScreenTracker:
+    """
+    Captures the screen of a machine and the rows changed since the previous capture, the first capture is compared
+    with a blank screen
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.previous = np.zeros((ROWS, ROW_WORDS), dtype=np.int16)
+
+    def capture(self):
+        """
+        Returns the frame as a view of the RAM, valid until the machine runs again, and the indexes of its changed rows
+        """
+        # The view is made on every capture, a restored snapshot replaces the RAM of the machine
+        frame = screen_view(self.machine)
+        rows = np.flatnonzero((frame != self.previous).any(axis=1))
+        self.previous[rows] = frame[rows]
+        return frame, rows
+
+
+def write_pbm(pbm_file, frame):
+    with open(pbm_file, 'wb') as file:
+        file.write(b'P4\n%d %d\n' % (WIDTH, ROWS))
+        file.write(np.packbits(frame_pixels(frame), axis=1).tobytes())
+
+
+def write_png(png_file, frame):
+    """
+    Write the frame as a 1 bit grayscale PNG, where a set bit is white
+    """
+    packed = np.packbits(1 - frame_pixels(frame), axis=1)
+    scanlines = np.hstack((np.zeros((ROWS, 1), dtype=np.uint8), packed))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(png_file, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', WIDTH, ROWS, 1, 0, 0, 0, 0)))
+        file.write(chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 9)))
+        file.write(chunk(b'IEND', b''))
+
+
+class FrameExporter:
+    """
+    Writes the frames that changed, as frame_<cycle>.pbm or .png files in a directory or to a single delta stream
+    file, which is read back with read_delta_stream
+    """
+
+    def __init__(self, path, frame_format='pbm'):
+        self.path = path
+        self.frame_format = frame_format
+        self.frames = 0
+        self.rows = 0
+        if frame_format == 'delta':
+            self.stream = open(path, 'wb')
+            self.stream.write(DELTA_MAGIC)
+        else:
+            self.stream = None
+            os.makedirs(path, exist_ok=True)
+
+    def export(self, cycle, frame, rows):
+        if not len(rows):
+            return
+        self.frames += 1
+        self.rows += len(rows)
+        if self.stream:
+            self.stream.write(DELTA_FRAME.pack(cycle, len(rows)))
+            self.stream.write(rows.astype(np.uint8).tobytes())
+            self.stream.write(np.ascontiguousarray(frame[rows], dtype='<i2').tobytes())
+        elif self.frame_format == 'png':
+            write_png(os.path.join(self.path, f'frame_{cycle:012}.png'), frame)
+        else:
+            write_pbm(os.path.join(self.path, f'frame_{cycle:012}.pbm'), frame)
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+
+
+def read_delta_stream(delta_file):
+    """
+    Replay a delta stream, yields the cycle and the whole (256, 32) screen of every frame in it, the same array is
+    updated in place for every frame
+    """
+    frame = np.zeros((ROWS, ROW_WORDS), dtype=np.int16)
+    with open(delta_file, 'rb') as file:
+        if file.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise Exception(f'Error in - {delta_file} is not a screen delta stream')
+        while header := file.read(DELTA_FRAME.size):
+            cycle, count = DELTA_FRAME.unpack(header)
+            rows = np.frombuffer(file.read(count), dtype=np.uint8)
+            frame[rows] = np.frombuffer(file.read(2 * ROW_WORDS * count), dtype='<i2').reshape(count, ROW_WORDS)
+            yield cycle, frame
+
+
+def record_frames(machine, max_cycles, every, exporter, tracker=None):
+    """
+    Run the machine in slices of every cycles and export the screen after each slice, returns the run status and the
+    cycles executed like a run of the machine. A tracker kept over several calls only exports the rows changed since
+    the last call
+    """
+    tracker = tracker or ScreenTracker(machine)
+    status = cpu.BUDGET
+    cycles = 0
+    while cycles < max_cycles and status == cpu.BUDGET:
+        status, executed = machine.run(min(every, max_cycles - cycles))
+        cycles += executed
+        exporter.export(machine.cycles, *tracker.capture())
+    return status, cycles
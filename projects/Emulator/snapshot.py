@@ -0,0 +1,57 @@
+"""
+Snapshots of a HACK machine, the registers, the cycle count and the whole RAM, screen included, tagged with the hash
+of the ROM they were taken of. RAM is stored page aligned after the header, a restore memory maps it copy on write and
+runs on the mapping directly, so restoring costs no copy and every CPU restored from the same snapshot forks from it.
+By
+    Naresh Joshi
+"""
+import mmap
+import struct
+import sys
+from array import array
+
+import cpu
+
+SNAPSHOT_MAGIC = b'HSNP'
+
+# Magic, ROM hash, A, D, PC and cycles, RAM follows as little endian int16 words at RAM_OFFSET
+SNAPSHOT_HEADER = struct.Struct('<4s20shhHQ')
+RAM_OFFSET = mmap.ALLOCATIONGRANULARITY
+
+
+def save_snapshot(snapshot_file, machine):
+    """
+    Write the registers, cycle count and RAM of the machine with the hash of its ROM
+    """
+    ram = array('h', machine.ram)
+    if sys.byteorder == 'big':
+        ram.byteswap()
+
+    with open(snapshot_file, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, cpu.rom_hash(machine.words), machine.a, machine.d, machine.pc,
+                                        machine.cycles))
+        file.write(bytes(RAM_OFFSET - SNAPSHOT_HEADER.size))
+        file.write(ram)
+
+
+def restore_snapshot(snapshot_file, machine):
+    """
+    Restore the machine to the snapshot, its RAM becomes a private copy on write mapping of the snapshot file
+    """
+    with open(snapshot_file, 'rb') as file:
+        snapshot = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    magic, digest, a, d, pc, cycles = SNAPSHOT_HEADER.unpack_from(snapshot)
+    if magic != SNAPSHOT_MAGIC:
+        raise Exception(f'Error in - {snapshot_file} is not a snapshot file')
+    if digest != cpu.rom_hash(machine.words):
+        raise Exception(f'Error in - {snapshot_file} was taken of a different ROM')
+
+    ram = memoryview(snapshot)[RAM_OFFSET:RAM_OFFSET + 2 * cpu.RAM_SIZE].cast('h')
+    if sys.byteorder == 'big':
+        # The mapping can only be used as is on little endian machines, elsewhere the words are copied and swapped
+        ram = array('h', ram)
+        ram.byteswap()
+
+    machine.ram = ram
+    machine.a, machine.d, machine.pc, machine.cycles = a, d, pc, cycles
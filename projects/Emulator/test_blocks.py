@@ -0,0 +1,80 @@
+"""
+Differential tests of the compiled blocks against the interpreter, random programs of every instruction are run on
+both engines for several budgets and must end in the same status, registers and RAM.
+We can run the tests in following ways
+    python3 -m pytest test_blocks.py
+By
+    Naresh Joshi
+"""
+import random
+from array import array
+
+import pytest
+
+import blocks
+from blocks import BlockCPU
+from cpu import CPU, assembler
+
+SEEDS = range(1500)
+BUDGETS = (1, 3, 17, 500)
+
+# RAM values around the ends of the 16 bit range, addresses and sums built from them wrap
+EDGE_VALUES = [-32768, -32767, -16384, -1, 0, 1, 2, 16384, 32766, 32767]
+
+DESTS = ['', 'M=', 'D=', 'A=', 'MD=', 'AM=', 'AD=', 'AMD=']
+JUMPS = [''] * 4 + [';JGT', ';JEQ', ';JGE', ';JLT', ';JNE', ';JLE', ';JMP']
+
+
+def random_program(seed, values=range(-5, 120)):
+    """
+    A program of random A and C-instructions, A-instructions mostly load small addresses and addresses of the program
+    itself, it ends in a halting loop. The RAM it starts with holds random values
+    """
+    generator = random.Random(seed)
+    length = generator.randint(5, 40)
+    lines = []
+    for _ in range(length):
+        if generator.random() < 0.35:
+            lines.append(f'@{generator.choice([0, 1, 2, 3, 5, 7, 100, generator.randint(0, length + 3)])}')
+        else:
+            dest = generator.choice(DESTS)
+            comp = generator.choice(list(assembler.computations))
+            jump = generator.choice(JUMPS)
+            lines.append(f'{dest or ("" if jump else "D=")}{comp}{jump}')
+    lines += ['(END)', '@END', '0;JMP']
+    ram = array('h', generator.choices(values, k=200))
+    return assembler.assemble('\n'.join(lines)), ram
+
+
+def run_both(words, ram, budget):
+    machines = CPU(words), BlockCPU(words)
+    for machine in machines:
+        machine.ram[:len(ram)] = ram
+    return [(machine.run(budget), machine.a, machine.d, machine.pc, machine.ram) for machine in machines]
+
+
+@pytest.mark.parametrize('list_ram_cycles', [blocks.LIST_RAM_CYCLES, 1])
+def test_random_programs(monkeypatch, list_ram_cycles):
+    # Every run is long enough for the list copy of the RAM when the threshold is 1
+    monkeypatch.setattr(blocks, 'LIST_RAM_CYCLES', list_ram_cycles)
+    for seed in SEEDS:
+        words, ram = random_program(seed)
+        for budget in BUDGETS:
+            expected, actual = run_both(words, ram, budget)
+            assert actual == expected, f'seed {seed} budget {budget}'
+
+
+def test_wrapping_registers():
+    for seed in SEEDS:
+        words, ram = random_program(seed, EDGE_VALUES)
+        for budget in BUDGETS:
+            expected, actual = run_both(words, ram, budget)
+            assert actual == expected, f'seed {seed} budget {budget}'
+
+
+def test_jump_writing_a():
+    # A jump that writes A returns the computed A, not the constant loaded before it
+    words = assembler.assemble('@7\nD=A\n@5\nA=D;JGT\n@0\nD=A\n@100\nM=D\n(E)\n@E\n0;JMP')
+    expected, actual = run_both(words, array('h'), 1000)
+    assert actual == expected
+    assert actual[4][100] == 7
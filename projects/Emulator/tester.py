@@ -0,0 +1,321 @@
+"""
+Headless runner of the CPU level test scripts, the .tst files that load an .asm or .hack program into the CPU emulator
+and the Computer.hdl scripts that load a .hack program into the ROM32K of the computer chip. Scripts are parsed once and
+executed on an in-process emulator, every output line is compared against the .cmp file as soon as it is produced and
+the first mismatch fails the script. Chip level scripts and scripts without a .cmp file are skipped.
+We can run the tester in following ways
+    python3 tester.py
+    python3 tester.py ../04 ../05 --jobs 4
+    python3 tester.py ../04/mult/Mult.tst --output
+    python3 tester.py --engine fused
+By
+    Naresh Joshi
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cpu import assembler, wrap
+from emulator import ENGINES, load_program
+
+PROJECTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Script statuses
+PASSED = 'passed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# Comments, quoted strings, braces, command terminators and words of the test script language
+SCRIPT_TOKEN = re.compile(r'//[^\n]*|/\*.*?\*/|"[^"]*"|[{},;!]|[^\s{},;!]+', re.DOTALL)
+
+# An output-list column, the variable with its format, left padding, width and right padding
+COLUMN = re.compile(r'(.+)%([BDSX])(\d+)\.(\d+)\.(\d+)')
+
+# A variable with an index, RAM[16384], RAM16K[0] and PC[] of the computer chip
+INDEXED_VARIABLE = re.compile(r'(\w+)\[(\d*)\]')
+
+
+def run():
+    args = parse_args()
+
+    tst_files = assembler.get_files(args.paths or [PROJECTS], '.tst')
+    if not run_scripts(tst_files, args.jobs, args.engine, args.output):
+        sys.exit(1)
+
+
+def run_scripts(tst_files, jobs=None, engine='blocks', output=False):
+    """
+    Run the scripts across a process pool, prints the result of every script in input order with the totals and
+    returns False if any script failed
+    """
+    start = time.perf_counter()
+    if jobs == 1:
+        results = [run_script(tst_file, engine, output) for tst_file in tst_files]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(run_script, tst_files, [engine] * len(tst_files), [output] * len(tst_files)))
+    wall_time = time.perf_counter() - start
+
+    totals = {PASSED: 0, FAILED: 0, SKIPPED: 0}
+    for tst_file, status, detail, seconds in results:
+        totals[status] += 1
+        print(f'{status.upper():>7} {seconds * 1000:8.1f} ms {os.path.relpath(tst_file)} : {detail}')
+
+    print(f'Passed {totals[PASSED]} of {len(results) - totals[SKIPPED]} scripts, {totals[FAILED]} failed, '
+          f'{totals[SKIPPED]} skipped in {wall_time:.3f} s wall time')
+    return totals[FAILED] == 0
+
+
+def run_script(tst_file, engine='blocks', output=False):
+    """
+    Run one script, returns (file, status, detail, seconds), an error in the script or its program fails it
+    """
+    start = time.perf_counter()
+    with open(tst_file) as file:
+        commands = parse_script(file.read())
+
+    reason = skip_reason(commands)
+    if reason:
+        return tst_file, SKIPPED, reason, time.perf_counter() - start
+
+    script = TestScript(tst_file, ENGINES[engine])
+    try:
+        script.execute(commands)
+        status, detail = PASSED, f'{script.compared} output lines compared'
+    except Exception as e:
+        status, detail = FAILED, str(e)
+    if output and script.output_file:
+        with open(script.output_file, 'w') as file:
+            file.writelines(line + '\n' for line in script.lines)
+    return tst_file, status, detail, time.perf_counter() - start
+
+
+def parse_script(text):
+    """
+    Parse a script to a list of (words, body) commands, body is None for a simple command and the list of commands
+    of a block for `repeat n { ... }`
+    """
+    tokens = (token for token in SCRIPT_TOKEN.findall(text) if not token.startswith(('//', '/*')))
+    return parse_block(tokens)
+
+
+def parse_block(tokens):
+    commands = []
+    words = []
+    for token in tokens:
+        if token in ',;!':
+            if words:
+                commands.append((words, None))
+                words = []
+        elif token == '{':
+            commands.append((words, parse_block(tokens)))
+            words = []
+        elif token == '}':
+            break
+        else:
+            words.append(token)
+    if words:
+        commands.append((words, None))
+    return commands
+
+
+def skip_reason(commands):
+    """
+    Why a script can not run here, None when it is a CPU level script with a .cmp file
+    """
+    loaded = [words[1] for words, body in commands if body is None and words[0] == 'load' and len(words) > 1]
+    if not loaded or not loaded[0].endswith(('.asm', '.hack', 'Computer.hdl')):
+        return f'not a CPU level script, it loads {loaded[0] if loaded else "a directory"}'
+    if not any(words[0] == 'compare-to' for words, body in commands):
+        return 'no compare-to file'
+    if any(body is not None and words != ['repeat', words[-1]] or words == ['repeat'] for words, body in commands):
+        return 'repeats forever'
+    return None
+
+
+class TestScript:
+    """
+    The state of a running script, the machine under test, the output list and the position in the .cmp file
+    """
+
+    def __init__(self, tst_file, engine):
+        self.tst_file = tst_file
+        self.directory = os.path.dirname(tst_file)
+        self.engine = engine
+        self.machine = engine([])
+        self.output_file = None
+        self.compare_file = None
+        self.expected = []
+        self.columns = []
+        self.lines = []
+        self.compared = 0
+        self.time = 0
+        self.half_cycle = False
+        self.reset = 0
+
+    def execute(self, commands):
+        for words, body in commands:
+            if body is None:
+                self.command(words)
+                continue
+
+            count = int(words[1])
+            if not self.reset and all(inner == ['ticktock'] for inner, inner_body in body):
+                # A repeat of nothing but cycles is a single run of the emulator
+                self.ticktock(count * len(body))
+            else:
+                for _ in range(count):
+                    self.execute(body)
+
+    def command(self, words):
+        name, *operands = words
+        if name == 'load':
+            if operands[0].endswith(('.asm', '.hack')):
+                self.load(operands[0])
+        elif name == 'ROM32K' and operands[0] == 'load':
+            self.load(operands[1])
+        elif name == 'output-file':
+            self.output_file = os.path.join(self.directory, operands[0])
+        elif name == 'compare-to':
+            self.compare_file = os.path.join(self.directory, operands[0])
+            with open(self.compare_file) as file:
+                self.expected = file.read().splitlines()
+        elif name == 'output-list':
+            self.columns = [self.column(text) for text in operands]
+            self.write('|' + ''.join(self.header(*column) + '|' for column in self.columns))
+        elif name == 'output':
+            self.write('|' + ''.join(self.value(*column) + '|' for column in self.columns))
+        elif name == 'set':
+            self.set(operands[0], parse_value(operands[1]))
+        elif name == 'ticktock':
+            self.ticktock(1)
+        elif name == 'tick':
+            self.half_cycle = True
+        elif name == 'tock':
+            self.ticktock(1)
+        elif name not in ('echo', 'clear-echo'):
+            raise Exception(f'Error in - {self.tst_file}, unsupported command {" ".join(words)}')
+
+    def load(self, program):
+        self.machine = self.engine(load_program(os.path.join(self.directory, program)))
+        # A repeat runs for all of its cycles even when the program is stuck in its final loop
+        self.machine.run_to_budget = True
+
+    def ticktock(self, cycles):
+        machine = self.machine
+        if self.reset:
+            # The instruction still executes on a clock with reset set, only the program counter goes back to 0
+            for _ in range(cycles):
+                machine.run(1)
+                machine.pc = 0
+        elif machine.pc < len(machine.words):
+            machine.run(cycles)
+        self.time += cycles
+        self.half_cycle = False
+
+    def set(self, name, value):
+        match = INDEXED_VARIABLE.fullmatch(name)
+        if match and match[1] in ('RAM', 'RAM16K'):
+            self.machine.ram[int(match[2])] = value
+            return
+
+        register = match[1] if match else name
+        if register in ('A', 'ARegister'):
+            self.machine.a = value
+        elif register in ('D', 'DRegister'):
+            self.machine.d = value
+        elif register == 'PC':
+            self.machine.pc = value & 0x7FFF
+        elif register == 'reset':
+            self.reset = value
+        else:
+            raise Exception(f'Error in - {self.tst_file}, unsupported variable {name}')
+
+    def get(self, name):
+        if name == 'time':
+            return f'{self.time}+' if self.half_cycle else str(self.time)
+
+        match = INDEXED_VARIABLE.fullmatch(name)
+        if match and match[1] in ('RAM', 'RAM16K'):
+            return self.machine.ram[int(match[2])]
+
+        register = match[1] if match else name
+        if register in ('A', 'ARegister'):
+            return self.machine.a
+        if register in ('D', 'DRegister'):
+            return self.machine.d
+        if register == 'PC':
+            return self.machine.pc
+        if register == 'reset':
+            return self.reset
+        raise Exception(f'Error in - {self.tst_file}, unsupported variable {name}')
+
+    def column(self, text):
+        match = COLUMN.fullmatch(text)
+        if not match:
+            raise Exception(f'Error in - {self.tst_file}, {text} is not a valid output-list column')
+        name, kind, left, width, right = match.groups()
+        return name, kind, int(left), int(width), int(right)
+
+    @staticmethod
+    def header(name, kind, left, width, right):
+        total = left + width + right
+        name = name[:total]
+        padding = (total - len(name)) // 2
+        return ' ' * padding + name + ' ' * (total - len(name) - padding)
+
+    def value(self, name, kind, left, width, right):
+        value = self.get(name)
+        if kind == 'S':
+            text = str(value).ljust(width)
+        elif kind == 'B':
+            text = format(value & 0xFFFF, '016b')[-width:]
+        elif kind == 'X':
+            text = format(value & 0xFFFF, '04X')[-width:]
+        else:
+            text = str(value).rjust(width)
+        return ' ' * left + text + ' ' * right
+
+    def write(self, line):
+        """
+        Compare an output line with the next line of the .cmp file, * in the .cmp file matches any character
+        """
+        self.lines.append(line)
+        number = len(self.lines)
+        expected = self.expected[number - 1].rstrip() if number <= len(self.expected) else None
+        if expected is None:
+            raise Exception(f'Error at line {number}, {os.path.basename(self.compare_file)} has no more lines')
+        if len(expected) != len(line) or any(e != '*' and e != c for e, c in zip(expected, line)):
+            raise Exception(f'Error at line {number}, expected {expected} got {line}')
+        self.compared = number
+
+
+def parse_value(text):
+    """
+    A script value, %B binary, %X hex, %D or plain decimal, as a signed 16 bit integer
+    """
+    if text.startswith('%B'):
+        return wrap(int(text[2:], 2))
+    if text.startswith('%X'):
+        return wrap(int(text[2:], 16))
+    if text.startswith('%D'):
+        text = text[2:]
+    return wrap(int(text))
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Run the CPU level .tst scripts and compare them to their .cmp '
+                                                     'files')
+    arg_parser.add_argument('paths', nargs='*', help='.tst files, directories or glob patterns, all the projects by '
+                                                     'default')
+    arg_parser.add_argument('--jobs', type=int, help='worker processes, one per CPU by default')
+    arg_parser.add_argument('--engine', choices=ENGINES, default='blocks', help='emulator engine of the scripts')
+    arg_parser.add_argument('--output', action='store_true', help='write the output-file of every script')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    run()
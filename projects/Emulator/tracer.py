@@ -0,0 +1,219 @@
+"""
+Instruction trace of the HACK CPU emulator for debugging. The tracing CPU keeps a record of every executed
+C-instruction in a preallocated ring buffer, the last N are kept and nothing is written out until the trace is flushed
+on demand or when the run faults. A record holds the program counter, A before the instruction, D after it and the ALU
+output, which is the value written to RAM[A] by an instruction with M in its destination, the reader decodes the ROM
+word at the program counter to tell which. The ring holds records as tuples of the register values, storing a tuple
+costs a third of packing the four values into an integer in the fetch loop, they are packed to 8 bytes when flushed.
+The A-instructions in between are not recorded, they are the straight line of instructions from where the previous
+record went on, its jump target or the next address, up to the record.
+A trace file is a header with the ROM hash, followed by the zlib compressed records from the oldest to the newest as
+little endian int16 quadruples.
+We can read a trace in following ways
+    python3 tracer.py program.asm program.trace
+    python3 tracer.py program.hack program.trace --last 100
+By
+    Naresh Joshi
+"""
+import argparse
+import itertools
+import struct
+import sys
+import zlib
+from array import array
+
+import cpu
+import emulator
+import profiler
+from cpu import DEST_A, DEST_D, DEST_M
+
+TRACE_MAGIC = b'HTRC'
+
+# Magic, ROM hash, records written since the CPU was created and records in the file
+TRACE_HEADER = struct.Struct('<4s20sQI')
+TRACE_RECORD = struct.Struct('<hhhh')
+
+# Records kept in the ring buffer by default, a power of 2
+TRACE_RECORDS = 1 << 16
+
+
+class TracingCPU(cpu.CPU):
+    """
+    The interpreter with a ring buffer of the records of the last executed C-instructions, records is rounded up to a
+    power of 2 so that the buffer index wraps with a mask. A run that leaves the ROM or raises, or is interrupted, is a
+    fault, the trace is then flushed to fault_file when one is set
+    """
+
+    def __init__(self, words, records=TRACE_RECORDS, fault_file=None):
+        super().__init__(words)
+        size = 1 << max(records - 1, 1).bit_length()
+        self.trace = [None] * size
+        self.traced = 0
+        self.fault_file = fault_file
+
+    def run(self, max_cycles):
+        rom = self.rom
+        ram = self.ram
+        loops = self.loops
+        trace = self.trace
+        mask = len(trace) - 1
+        traced = self.traced
+        a = self.a
+        d = self.d
+        pc = self.pc
+
+        status = cpu.BUDGET
+        cycles = 0
+        last_target = pc
+        try:
+            for cycles in range(max_cycles):
+                is_address, value, comp, reads_m, dest, jump = rom[pc]
+                if is_address:
+                    a = value
+                    pc += 1
+                    continue
+
+                out = comp(a, d, ram[a] if reads_m else 0)
+                if dest & DEST_M:
+                    ram[a] = out
+                if dest & DEST_D:
+                    d = out
+                trace[traced & mask] = pc, a, d, out
+                traced += 1
+
+                if jump is not None and jump[(out > 0) - (out < 0) + 1]:
+                    target = a & 0x7FFF
+                    if dest & DEST_A:
+                        a = out
+                    if cpu.ends_full_pass(loops, pc, last_target, target):
+                        jump_address = pc
+                        status = cpu.IDLE
+                        pc = target
+                        cycles += 1
+                        break
+                    last_target = pc = target
+                    continue
+                pc += 1
+                if dest & DEST_A:
+                    a = out
+            else:
+                cycles = max_cycles
+        except IndexError:
+            status = cpu.END
+        except BaseException:
+            self.traced = traced
+            self.a, self.d, self.pc = a, d, pc
+            self.fault()
+            raise
+
+        if pc >= len(rom):
+            status = cpu.END
+        self.traced = traced
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        if status == cpu.END:
+            self.fault()
+        if status == cpu.IDLE:
+            return self.idle(jump_address, max_cycles - cycles, cycles)
+        return status, cycles
+
+    def fault(self):
+        if self.fault_file:
+            self.flush(self.fault_file)
+
+    def records(self):
+        """
+        The records in the ring buffer from the oldest to the newest
+        """
+        size = len(self.trace)
+        if self.traced <= size:
+            return self.trace[:self.traced]
+        start = self.traced & (size - 1)
+        return self.trace[start:] + self.trace[:start]
+
+    def flush(self, trace_file):
+        """
+        Write the records in the ring buffer to a compressed trace file, returns the number of records written
+        """
+        records = self.records()
+        packed = array('h', itertools.chain.from_iterable(records))
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        with open(trace_file, 'wb') as file:
+            file.write(TRACE_HEADER.pack(TRACE_MAGIC, cpu.rom_hash(self.words), self.traced, len(records)))
+            file.write(zlib.compress(packed, 1))
+        return len(records)
+
+
+def read_trace(trace_file):
+    """
+    Read a trace file, returns its ROM hash, the number of records traced up to its newest record and the records
+    """
+    with open(trace_file, 'rb') as file:
+        data = file.read()
+
+    magic, digest, traced, count = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC:
+        raise Exception(f'Error in - {trace_file} is not a trace file')
+    records = list(TRACE_RECORD.iter_unpack(zlib.decompress(data[TRACE_HEADER.size:])))
+    if len(records) != count:
+        raise Exception(f'Error in - {trace_file} is truncated, {len(records)} of {count} records')
+    return digest, traced, records
+
+
+def trace_lines(words, records, traced, source_map=()):
+    """
+    Yield a line per executed instruction with its record number, address, source, the registers after it, the RAM
+    word it wrote and its label and vm command. The A-instructions between two records are filled in from the ROM
+    """
+    by_address = {entry['address']: entry for entry in source_map}
+
+    def line(number, pc, a, d, written):
+        entry = by_address.get(pc, {})
+        location = entry.get('label') or ''
+        if entry.get('vm'):
+            location += f' {entry["vm"]}'
+        return (f'{number:>12} {pc:6} {entry.get("source", ""):<12} A = {a:6} D = {d:6} {written:<22} '
+                f'{location}').rstrip()
+
+    next_pc = None
+    previous_d = 0
+    for number, record in enumerate(records, traced - len(records)):
+        pc, a, d, out = record
+        if next_pc is not None and next_pc <= pc:
+            for address in range(next_pc, pc):
+                yield line('', address, words[address], previous_d, '')
+
+        word = words[pc]
+        dest = (word >> 3) & 0b111
+        jump = cpu.jump_conditions.get(word & 0b111)
+        taken = jump is not None and jump[(out > 0) - (out < 0) + 1]
+        next_pc = a & 0x7FFF if taken else pc + 1
+        yield line(number, pc, out if dest & DEST_A else a, d, f'RAM[{a}] = {out}' if dest & DEST_M else '')
+        previous_d = d
+
+
+def run():
+    args = parse_args()
+
+    words = emulator.load_program(args.program)
+    digest, traced, records = read_trace(args.trace)
+    if digest != cpu.rom_hash(words):
+        raise Exception(f'Error in - {args.trace} was traced on a different ROM than {args.program}')
+
+    source_map = profiler.load_source_map(args.program)
+    print(f'{len(records)} of {traced} traced C-instructions, the last one faulted or was the end of the trace')
+    for line in trace_lines(words, records[-args.last:] if args.last else records, traced, source_map):
+        print(line)
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Print a trace of the HACK CPU emulator through the source map')
+    arg_parser.add_argument('program', help='the .hack, packed .rom or .asm file the trace was taken of')
+    arg_parser.add_argument('trace', help='trace file written by the emulator')
+    arg_parser.add_argument('--last', type=int, help='print only the newest records')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    run()
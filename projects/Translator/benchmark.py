@@ -0,0 +1,245 @@
+"""
+Throughput benchmark of the VM translator over the VM files of the operating system and project 08, it reports the VM
+lines read and translated per second by the command table and by the if/elif dispatch it replaced, kept here as the
+baseline.
+We can run the benchmark in following ways
+    python3 benchmark.py
+    python3 benchmark.py --repeat 50
+    python3 benchmark.py ../07 ../../tools/OS/Math.vm
+
+By
+    Naresh Joshi
+"""
+import argparse
+import glob
+import os
+import random
+import time
+
+import translator
+from translator import de_comment
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+DEFAULT_PATHS = [os.path.join(ROOT, 'tools', 'OS'), os.path.join(ROOT, 'projects', '08')]
+
+
+def run():
+    args = parse_args()
+
+    vm_files = get_vm_files(args.paths)
+    print(f'translator : {len(vm_files)} VM files, {args.repeat} passes')
+
+    sources, read_seconds = measure(read_sources, vm_files, args.repeat)
+    lines = sum(len([line for line in vm_instructions if line]) for program, vm_instructions in sources)
+    report('read and de-comment', lines * args.repeat, read_seconds)
+
+    # Both translations draw the same random call labels, so their output has to match
+    random.seed(0)
+    legacy_output = translate(sources, args.repeat, legacy_parse_vm_instructions)
+    random.seed(0)
+    output = translate(sources, args.repeat, translator.parse_vm_instructions)
+    if output != legacy_output:
+        raise Exception('Error in - the command table does not translate like the if/elif dispatch')
+
+    _, legacy_seconds = measure(translate, sources, args.repeat, legacy_parse_vm_instructions)
+    report('translate, if/elif dispatch', lines * args.repeat, legacy_seconds)
+    _, translate_seconds = measure(translate, sources, args.repeat, translator.parse_vm_instructions)
+    report('translate, command table', lines * args.repeat, translate_seconds)
+    print(f'{len(output)} assembly lines per pass, {len(output) * args.repeat / translate_seconds:,.0f} assembly '
+          f'lines/s')
+    print(f'Speedup : {legacy_seconds / translate_seconds:.2f}x')
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='VM translator benchmark')
+    arg_parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS, help='VM files or directories, the operating '
+                                                                            'system and project 08 by default')
+    arg_parser.add_argument('--repeat', type=int, default=20, help='passes over the VM files')
+    return arg_parser.parse_args()
+
+
+def get_vm_files(paths):
+    vm_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            vm_files += glob.glob(os.path.join(path, '**', '*.vm'), recursive=True)
+        else:
+            vm_files.append(path)
+    return sorted(vm_files)
+
+
+def read_sources(vm_files, repeat):
+    for _ in range(repeat):
+        sources = [(vm_file.replace('.vm', '').split('/')[-1], de_comment(vm_file)) for vm_file in vm_files]
+    return sources
+
+
+def translate(sources, repeat, parse_vm_instructions):
+    """
+    Translate every source repeat times, returns the assembly of the last pass
+    """
+    for _ in range(repeat):
+        # Every pass starts cold, push and pop code memoized by an earlier pass would flatter the later ones
+        translator.parse_push.cache_clear()
+        translator.parse_pop.cache_clear()
+        asm_instructions = []
+        for program, vm_instructions in sources:
+            asm_instructions += parse_vm_instructions(program, vm_instructions)
+    return asm_instructions
+
+
+def legacy_parse_vm_instructions(program, vm_instructions):
+    line_count = 0
+    asm_instructions = []
+
+    if program == "Sys":
+        asm_instructions += translator.sys_init(program)
+
+    for instruction in vm_instructions:
+        line_count += 1
+        if instruction:
+            asm_instructions.append(f"// {instruction}")
+            asm_instructions += legacy_parse_vm_instruction(program, line_count, instruction)
+    return asm_instructions
+
+
+def legacy_parse_vm_instruction(program, line_count, instruction):
+    """
+    The if/elif dispatch the translator used before the command table, a string comparison per command tried
+    """
+    if instruction == "add":
+        return translator.ADD
+    elif instruction == "sub":
+        return translator.SUB
+    elif instruction == "neg":
+        return translator.NEG
+    elif instruction == "eq":
+        return translator.equality(program, line_count, instruction)
+    elif instruction == "gt":
+        return translator.equality(program, line_count, instruction)
+    elif instruction == "lt":
+        return translator.equality(program, line_count, instruction)
+    elif instruction == "and":
+        return translator.AND
+    elif instruction == "or":
+        return translator.OR
+    elif instruction == "not":
+        return translator.NOT
+    else:
+        tokens = instruction.split(" ")
+        if len(tokens) <= 0 or len(tokens) > 3:
+            raise Exception(f'Error at line {line_count}, {instruction} is not a valid instruction')
+        elif tokens[0] == "push":
+            return legacy_parse_push(program, tokens[1], tokens[2])
+        elif tokens[0] == "pop":
+            return legacy_parse_pop(program, tokens[1], tokens[2])
+        elif tokens[0] == "label":
+            return [f"({program}_{tokens[1]})"]
+        elif tokens[0] == "goto":
+            return translator.goto(program, tokens[1])
+        elif tokens[0] == "if-goto":
+            return translator.if_goto(program, tokens[1])
+        elif tokens[0] == "function":
+            return translator.function(tokens[1], tokens[2])
+        elif tokens[0] == "call":
+            return translator.call(program, tokens[1], tokens[2])
+        elif tokens[0] == "return":
+            return translator.RETURN
+        else:
+            raise Exception(f'Error at line {line_count}, {instruction} is not a valid instruction')
+
+
+def legacy_parse_push(program, segment, index):
+    """
+    The push code built afresh by list concatenation for every command
+    """
+    if segment in ["local", "argument", "this", "that"]:
+        return [
+                   f"@{translator.segments[segment]}",
+                   "D=M",
+                   f"@{index}",
+                   "A=D+A",
+                   "D=M",
+               ] + translator.PUSH
+    elif segment == "pointer":
+        if index in ["0", "1"]:
+            return [
+                       "@THIS" if index == "0" else "@THAT",
+                       "D=M",
+                   ] + translator.PUSH
+        else:
+            raise Exception(f'Error at - push {segment} {index} is not a valid instruction')
+    elif segment == "constant":
+        return [
+                   f"@{index}",
+                   "D=A",
+               ] + translator.PUSH
+    elif segment == "static":
+        return [
+                   f"@{program}_{index}",
+                   "D=M",
+               ] + translator.PUSH
+    elif segment == "temp":
+        return [
+                   "@R5",
+                   "D=A",
+                   f"@{index}",
+                   "A=D+A",
+                   "D=M",
+               ] + translator.PUSH
+    else:
+        raise Exception(f'Error at - push {segment} {index} is not a valid instruction')
+
+
+def legacy_parse_pop(program, segment, index):
+    if segment in ["local", "argument", "this", "that"]:
+        return [
+                   f"@{translator.segments[segment]}",
+                   "D=M",
+                   f"@{index}",
+                   "D=D+A"
+               ] + translator.POP
+    elif segment == "pointer":
+        if index in ["0", "1"]:
+            return [
+                "@SP",
+                "AM=M-1",
+                "D=M",
+                "M=0",
+                "@THIS" if index == "0" else "@THAT",
+                "M=D"
+            ]
+        else:
+            raise Exception(f'Error at - pop {segment} {index} is not a valid instruction')
+    elif segment == "static":
+        return [
+            "@SP",
+            "AM=M-1",
+            "D=M",
+            "M=0",
+            f"@{program}_{index}",
+            "M=D"
+        ]
+    elif segment == "temp":
+        return [
+                   "@R5",
+                   "D=A",
+                   f"@{index}",
+                   "D=D+A"
+               ] + translator.POP
+    else:
+        raise Exception(f'Error at - pop {segment} {index} is not a valid instruction')
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def report(name, count, seconds, unit='VM lines'):
+    print(f'{name:<30} {seconds:8.3f} s {count / seconds:14,.0f} {unit}/s')
+
+
+if __name__ == '__main__':
+    run()
@@ -5,10 +5,13 @@ We can run the translator in following ways
     python3 translator.py vm_file1.vm,vm_file2.vm
     python3 translator.py directory_of_vm_file
 
+Every VM line is split into its tokens once and translated by the emitter of its command in the commands table, push and
+pop code is generated once per program, segment and index and a line repeated in a file reuses its earlier code.
 If present then Sys.vm file needs to be passed in as first file to the translator program to initiate the execution
 By
     Naresh Joshi
 """
+import functools
 import os
 import random
 import re
@@ -142,6 +145,43 @@ RETURN = [
     "0;JMP"
 ]
 
+# Pops y and compares x - y in D, clearing both, the jump to the comparison label skips setting the result to true
+COMPARE = [
+    "@SP",
+    "AM=M-1",
+    "D=M",
+    "M=0",
+    "A=A-1",
+    "D=M-D",
+    "M=0"
+]
+
+COMPARE_TRUE = [
+    "@SP",
+    "A=M",
+    "A=A-1",
+    "M=-1"
+]
+
+comparison_jumps = {
+    "eq": "JNE",
+    "gt": "JLE",
+    "lt": "JGE"
+}
+
+POP_D = [
+    "@SP",
+    "AM=M-1",
+    "D=M",
+    "M=0"
+]
+
+# Clears one local variable of a function
+PUSH_LOCAL = [
+    "M=0",
+    "A=A+1"
+]
+
 
 def run():
     file_path = 'input.vm'
@@ -220,83 +260,46 @@ def parse_vm_instructions(program, vm_instructions):
     if program == "Sys":
         asm_instructions += sys_init(program)
 
+    # Code of the lines translated so far whose code does not depend on their line number, with their comment
+    translations = {}
     for instruction in vm_instructions:
         line_count += 1
-        if instruction:
-            asm_instructions.append(f"// {instruction}")
-            asm_instructions += parse_vm_instruction(program, line_count, instruction)
+        if not instruction:
+            continue
+        code = translations.get(instruction)
+        if code is None:
+            code, reusable = parse_vm_instruction(program, line_count, instruction)
+            code = [f"// {instruction}"] + code
+            if reusable:
+                translations[instruction] = code
+        asm_instructions += code
     return asm_instructions
 
 
 def parse_vm_instruction(program, line_count, instruction):
-    if instruction == "add":
-        return ADD
-    elif instruction == "sub":
-        return SUB
-    elif instruction == "neg":
-        return NEG
-    elif instruction == "eq":
-        return equality(program, line_count, instruction)
-    elif instruction == "gt":
-        return equality(program, line_count, instruction)
-    elif instruction == "lt":
-        return equality(program, line_count, instruction)
-    elif instruction == "and":
-        return AND
-    elif instruction == "or":
-        return OR
-    elif instruction == "not":
-        return NOT
-    else:
-        tokens = instruction.split(" ")
-        if len(tokens) <= 0 or len(tokens) > 3:
-            raise Exception(f'Error at line {line_count}, {instruction} is not a valid instruction')
-        elif tokens[0] == "push":
-            return parse_push(program, tokens[1], tokens[2])
-        elif tokens[0] == "pop":
-            return parse_pop(program, tokens[1], tokens[2])
-        elif tokens[0] == "label":
-            return [f"({program}_{tokens[1]})"]
-        elif tokens[0] == "goto":
-            return goto(program, tokens[1])
-        elif tokens[0] == "if-goto":
-            return if_goto(program, tokens[1])
-        elif tokens[0] == "function":
-            return function(tokens[1], tokens[2])
-        elif tokens[0] == "call":
-            return call(program, tokens[1], tokens[2])
-        elif tokens[0] == "return":
-            return RETURN
-        else:
-            raise Exception(f'Error at line {line_count}, {instruction} is not a valid instruction')
+    """
+    Returns the code of a VM line and whether every line of the same text in the file translates to it
+    """
+    tokens = instruction.split()
+    command = commands.get(tokens[0])
+    if command is None or len(tokens) != command[0]:
+        raise Exception(f'Error at line {line_count}, {instruction} is not a valid instruction')
+    token_count, emitter, reusable = command
+    return emitter(program, line_count, tokens), reusable
 
 
 def equality(program, line_count, operation):
-    operations = {
-        "eq": "JNE",
-        "gt": "JLE",
-        "lt": "JGE"
-    }
-    return [
-        "@SP",
-        "AM=M-1",
-        "D=M",
-        "M=0",
-        "A=A-1",
-        "D=M-D",
-        "M=0",
+    return COMPARE + [
         f"@{operation}_{program}_{line_count}",
-        f"D;{operations[operation]}",
-        "@SP",
-        "A=M",
-        "A=A-1",
-        "M=-1",
-        f"({operation}_{program}_{line_count})",
+        f"D;{comparison_jumps[operation]}"
+    ] + COMPARE_TRUE + [
+        f"({operation}_{program}_{line_count})"
     ]
 
 
+@functools.lru_cache(maxsize=None)
 def parse_push(program, segment, index):
-    if segment in ["local", "argument", "this", "that"]:
+    if segment in segments:
         return [
                    f"@{segments[segment]}",
                    "D=M",
@@ -334,8 +337,9 @@ def parse_push(program, segment, index):
         raise Exception(f'Error at - push {segment} {index} is not a valid instruction')
 
 
+@functools.lru_cache(maxsize=None)
 def parse_pop(program, segment, index):
-    if segment in ["local", "argument", "this", "that"]:
+    if segment in segments:
         return [
                    f"@{segments[segment]}",
                    "D=M",
@@ -344,22 +348,14 @@ def parse_pop(program, segment, index):
                ] + POP
     elif segment == "pointer":
         if index in ["0", "1"]:
-            return [
-                "@SP",
-                "AM=M-1",
-                "D=M",
-                "M=0",
+            return POP_D + [
                 "@THIS" if index == "0" else "@THAT",
                 "M=D"
             ]
         else:
             raise Exception(f'Error at - pop {segment} {index} is not a valid instruction')
     elif segment == "static":
-        return [
-            "@SP",
-            "AM=M-1",
-            "D=M",
-            "M=0",
+        return POP_D + [
             f"@{program}_{index}",
             "M=D"
         ]
@@ -382,30 +378,18 @@ def goto(program, label):
 
 
 def if_goto(program, label):
-    return [
-        "@SP",
-        "AM=M-1",
-        "D=M",
-        "M=0",
+    return POP_D + [
         f"@{program}_{label}",
         "D;JNE"
     ]
 
 
 def function(f, k):
-    instructions = [
+    return [
         f"({f})",
         "@SP",
         "A=M"
-    ]
-
-    for i in range(int(k)):
-        instructions += [
-            "M=0",
-            "A=A+1"
-        ]
-
-    return instructions + [
+    ] + PUSH_LOCAL * int(k) + [
         "D=A",
         "@SP",
         "M=D"
@@ -490,4 +474,28 @@ def generate_asm(asm_file, asm_instructions):
             file.write(instruction + '\n')
 
 
-run()
+# Token count, emitter and whether the code can be reused for every VM command, an emitter takes the program, line
+# number and tokens of a VM line. Comparisons have labels of their line and calls random labels, so their code is not
+# reused
+commands = {
+    "add": (1, lambda program, line_count, tokens: ADD, True),
+    "sub": (1, lambda program, line_count, tokens: SUB, True),
+    "neg": (1, lambda program, line_count, tokens: NEG, True),
+    "eq": (1, lambda program, line_count, tokens: equality(program, line_count, tokens[0]), False),
+    "gt": (1, lambda program, line_count, tokens: equality(program, line_count, tokens[0]), False),
+    "lt": (1, lambda program, line_count, tokens: equality(program, line_count, tokens[0]), False),
+    "and": (1, lambda program, line_count, tokens: AND, True),
+    "or": (1, lambda program, line_count, tokens: OR, True),
+    "not": (1, lambda program, line_count, tokens: NOT, True),
+    "push": (3, lambda program, line_count, tokens: parse_push(program, tokens[1], tokens[2]), True),
+    "pop": (3, lambda program, line_count, tokens: parse_pop(program, tokens[1], tokens[2]), True),
+    "label": (2, lambda program, line_count, tokens: [f"({program}_{tokens[1]})"], True),
+    "goto": (2, lambda program, line_count, tokens: goto(program, tokens[1]), True),
+    "if-goto": (2, lambda program, line_count, tokens: if_goto(program, tokens[1]), True),
+    "function": (3, lambda program, line_count, tokens: function(tokens[1], tokens[2]), True),
+    "call": (3, lambda program, line_count, tokens: call(program, tokens[1], tokens[2]), False),
+    "return": (1, lambda program, line_count, tokens: RETURN, True)
+}
+
+if __name__ == '__main__':
+    run()